@@ -0,0 +1,7 @@
+"""Micro-benchmarks for Moire hot paths.
+
+Run a benchmark as a module, e.g. `python -m benchmarks.trim`.
+"""
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
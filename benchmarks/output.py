@@ -0,0 +1,75 @@
+"""Benchmark of large tables and lists.
+
+Renders tables and lists with growing number of rows in all default formats.
+Time per row should not grow with the number of rows.
+"""
+
+import sys
+import timeit
+from typing import Any
+
+from moire.default import (
+    DefaultHTML,
+    DefaultMarkdown,
+    DefaultTeX,
+    DefaultText,
+    DefaultWiki,
+)
+from moire.moire import Moire
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+SIZES: list[int] = [1_000, 10_000, 100_000]
+FORMATS: list[type[Moire]] = [
+    DefaultHTML,
+    DefaultMarkdown,
+    DefaultTeX,
+    DefaultText,
+    DefaultWiki,
+]
+
+
+def get_table(size: int) -> str:
+    """Get code of the table with `size` rows."""
+    rows: str = " ".join(
+        f"{{{{cell {index}}} {{\\c {{code}}}} {{{index * index}}}}}"
+        for index in range(size)
+    )
+    return f"\\table {rows}"
+
+
+def get_list(size: int) -> str:
+    """Get code of the list with `size` items."""
+    items: str = " ".join(f"{{\\c {{item {index}}}}}" for index in range(size))
+    return f"\\list {items}"
+
+
+def measure(converter: Moire, ir: list[Any]) -> float:
+    """Get the best time of conversion in seconds."""
+    timings: list[float] = timeit.repeat(
+        lambda: converter.convert_ir(ir, wrap=False), number=1, repeat=3
+    )
+    return min(timings)
+
+
+def main() -> None:
+    """Print time per row for tables and lists of different sizes."""
+    sys.stdout.write(
+        f"{'format':<10}{'element':<8}{'rows':>10}{'time, s':>10}"
+        f"{'per row, us':>14}\n"
+    )
+    for class_ in FORMATS:
+        converter: Moire = class_()
+        for element, get_code in ("table", get_table), ("list", get_list):
+            for size in SIZES:
+                ir: list[Any] = converter.get_ir(get_code(size))
+                time: float = measure(converter, ir)
+                sys.stdout.write(
+                    f"{class_.id_:<10}{element:<8}{size:>10}{time:>10.3f}"
+                    f"{time / size * 1e6:>14.2f}\n"
+                )
+
+
+if __name__ == "__main__":
+    main()
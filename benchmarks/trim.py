@@ -0,0 +1,67 @@
+"""Benchmark of space collapsing in text leaves.
+
+Compares `moire.moire.trim_inside` with the original character-by-character
+implementation on paragraphs of different lengths.
+"""
+
+import sys
+import timeit
+from collections.abc import Callable
+
+from moire.moire import SPACES, trim_inside
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+LENGTHS: list[int] = [100, 10_000, 1_000_000]
+
+
+def trim_inside_reference(text: str) -> str:
+    """Replace all space symbol sequences with one space character.
+
+    Original implementation, kept for comparison.
+    """
+    result: str = ""
+    index: int = 0
+    while index < len(text):
+        if text[index] in SPACES:
+            result += " "
+            while index < len(text) and text[index] in SPACES:
+                index += 1
+            continue
+        result += text[index]
+        index += 1
+    return result
+
+
+def measure(function: Callable[[str], str], text: str) -> float:
+    """Get the best time of one call in seconds."""
+    number: int = max(1, 100_000 // len(text))
+    timings: list[float] = timeit.repeat(
+        lambda: function(text), number=number, repeat=3
+    )
+    return min(timings) / number
+
+
+def main() -> None:
+    """Print timings for texts with and without space sequences."""
+    samples: dict[str, str] = {
+        "single spaces": "Lorem ipsum dolor sit amet, consectetur. ",
+        "space runs": "Lorem  ipsum\n dolor\tsit amet,\n\nconsectetur. ",
+    }
+    sys.stdout.write(
+        f"{'text':<15}{'length':>10}{'reference, s':>15}{'current, s':>15}\n"
+    )
+    for name, sample in samples.items():
+        for length in LENGTHS:
+            text: str = (sample * (length // len(sample) + 1))[:length]
+            assert trim_inside(text) == trim_inside_reference(text)
+            reference: float = measure(trim_inside_reference, text)
+            current: float = measure(trim_inside, text)
+            sys.stdout.write(
+                f"{name:<15}{length:>10}{reference:>15.6f}{current:>15.6f}\n"
+            )
+
+
+if __name__ == "__main__":
+    main()
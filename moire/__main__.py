@@ -3,72 +3,388 @@
 """Moire entry point.
 
 Converts code in Moire markup to other formats, such as HTML, TeX, etc.
+
+Modules that are needed only by some commands are imported by these commands,
+and converter classes are imported only when their format is selected, so that
+one-off conversions start fast.
 """
 
+from __future__ import annotations
+
+import importlib
 import logging
+import os
 import sys
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, TextIO
 
-from moire.default import Default
-from moire.moire import Moire
+from moire.moire import Moire, ParseError, Tree, build_content_tree
+
+if TYPE_CHECKING:
+    from moire.build import BuildReport
+    from moire.cache import IRCache
 
 __author__ = "Sergey Vartanov"
 __email__ = "me@enzet.ru"
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+FORMATS: dict[str, str] = {
+    "html": "moire.default.DefaultHTML",
+    "markdown": "moire.default.DefaultMarkdown",
+    "tex": "moire.default.DefaultTeX",
+    "text": "moire.default.DefaultText",
+    "wiki": "moire.default.DefaultWiki",
+}
+"""Qualified names of default converter classes by format identifiers, see
+`Moire.id_`."""
+
+
+def get_converter_class(
+    top_class: type[Moire] | None, format_: str
+) -> type[Moire] | None:
+    """Get converter class for the format.
+
+    :param top_class: base class of converters; if not set, the class is
+        imported from `FORMATS`
+    :param format_: format identifier, see `Moire.id_`
+    """
+    if top_class is None:
+        if format_ not in FORMATS:
+            return None
+        module_name, _, class_name = FORMATS[format_].rpartition(".")
+        class_: type[Moire] = getattr(
+            importlib.import_module(module_name), class_name
+        )
+        return class_
+
+    converter_class: type[Moire] | None = None
+    for class_ in top_class.__subclasses__():
+        if class_.id_ == format_:
+            converter_class = class_
+    return converter_class
+
+
+def get_converter_classes(
+    top_class: type[Moire] | None,
+) -> dict[str, type[Moire]]:
+    """Get all converter classes by format identifiers.
+
+    :param top_class: base class of converters; if not set, classes from
+        `FORMATS` are imported
+    """
+    if top_class is None:
+        classes: dict[str, type[Moire]] = {}
+        for format_ in FORMATS:
+            class_: type[Moire] | None = get_converter_class(None, format_)
+            if class_:
+                classes[format_] = class_
+        return classes
+
+    return {class_.id_: class_ for class_ in top_class.__subclasses__()}
+
 
 def main(
     arguments: list[str] | None = None, top_class: type[Moire] | None = None
 ) -> None:
-    """Convert Moire markup to other formats."""
+    """Convert Moire markup to other formats.
+
+    :param arguments: command line arguments
+    :param top_class: base class of converters; if not set, default converters
+        from `FORMATS` are used
+    """
 
     if not arguments:
         arguments = sys.argv[1:]
-    if not top_class:
-        top_class = Default
 
     logging.basicConfig(level=logging.INFO, format="%(message)s")
 
+    if arguments and arguments[0] == "build":
+        build_command(arguments[1:], top_class)
+        return
+    if arguments and arguments[0] == "serve":
+        serve_command(arguments[1:], top_class)
+        return
+
     parser: ArgumentParser = ArgumentParser()
 
     parser.add_argument("-i", "--input", help="Moire input file", required=True)
-    parser.add_argument("-o", "--output", help="output file")
-    parser.add_argument("-f", "--format", help="output format", required=True)
+    parser.add_argument(
+        "-o", "--output", nargs="+", help="output files, one for each format"
+    )
+    parser.add_argument(
+        "-f", "--format", nargs="+", help="output formats", required=True
+    )
     parser.add_argument("--wrap", action="store_true", default=True)
+    parser.add_argument(
+        "--cache-dir", help="directory for cached intermediate representations"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="convert again on every change of the input file",
+    )
 
     options: Namespace = parser.parse_args(arguments)
 
-    converter: Moire | None = None
-    for class_ in top_class.__subclasses__():
-        if class_.id_ == options.format:
-            converter = class_()
+    classes: list[type[Moire]] = []
+    for format_ in options.format:
+        class_: type[Moire] | None = get_converter_class(top_class, format_)
+        if not class_:
+            logger.fatal("No converter class found for format `%s`.", format_)
+            sys.exit(1)
+        classes.append(class_)
+
+    outputs: list[str] = options.output or []
+    if len(outputs) != len(classes) and (outputs or len(classes) > 1):
+        logger.fatal("Output file should be specified for each format.")
+        sys.exit(1)
+
+    ir_cache: IRCache | None = None
+    if options.cache_dir:
+        from moire.cache import IRCache  # noqa: PLC0415
+
+        ir_cache = IRCache(Path(options.cache_dir))
+
+    if options.watch:
+        from moire.watch import Watcher, watch  # noqa: PLC0415
+
+        # Converters keep definitions and other state of the converted
+        # document, so that they are created again for every conversion.
+        watch(
+            Watcher(lambda: [options.input]),
+            lambda: convert(
+                options.input,
+                create_converters(classes, options.input, ir_cache),
+                outputs,
+                wrap=options.wrap,
+            ),
+        )
+    elif not convert(
+        options.input,
+        create_converters(classes, options.input, ir_cache),
+        outputs,
+        wrap=options.wrap,
+    ):
+        sys.exit(1)
+
+
+def create_converters(
+    classes: list[type[Moire]], input_path: str, ir_cache: IRCache | None
+) -> list[Moire]:
+    """Create converters for one conversion of the file.
+
+    :param classes: converter classes, one for each format
+    :param input_path: Moire file
+    :param ir_cache: cache of intermediate representations, used by the first
+        converter, that parses the file
+    """
+    converters: list[Moire] = []
+    for class_ in classes:
+        converter: Moire = class_()
+        converter.file_name = input_path
+        converters.append(converter)
+    converters[0].ir_cache = ir_cache
+    return converters
+
+
+def convert(
+    input_path: str,
+    converters: list[Moire],
+    outputs: list[str],
+    *,
+    wrap: bool = True,
+) -> bool:
+    """Convert Moire file to all formats.
+
+    :param input_path: Moire file
+    :param converters: converters, one for each format
+    :param outputs: output files, one for each converter; if empty, the output
+        of the only converter is written to the standard output
+    :param wrap: wrap output as a complete document
+    :return: true if the file is converted
+    """
+    # The input is parsed once for all formats.
+    try:
+        with Path(input_path).open(encoding="utf-8") as input_file:
+            source: str | TextIO = input_file
+            if converters[0].ir_cache:
+                source = input_file.read()
+            ir: list[Any] = converters[0].get_ir(source)
+    except (OSError, ParseError) as error:
+        logger.fatal("Error in `%s`: %s", input_path, error)
+        return False
 
-    if not converter:
+    content_root: Tree = build_content_tree(ir)
+
+    # Output is written as it is produced.
+    if not outputs:
+        converters[0].convert_ir(
+            ir, wrap=wrap, output=sys.stdout, content_root=content_root
+        )
+        sys.stdout.flush()
+        return True
+
+    for converter, output in zip(converters, outputs, strict=True):
+        if not write_output(
+            Path(output), converter, ir, wrap=wrap, content_root=content_root
+        ):
+            return False
+        logger.info("Converted to %s.", output)
+
+    return True
+
+
+def write_output(
+    path: Path,
+    converter: Moire,
+    ir: list[Any],
+    *,
+    wrap: bool,
+    content_root: Tree,
+) -> bool:
+    """Write converted intermediate representation to the file.
+
+    Output is streamed into a temporary file in the same directory, which
+    replaces the file only if conversion succeeds, so that an error does not
+    leave a partial or empty file instead of the previous one.
+
+    :param path: output file
+    :param converter: converter of the format
+    :param ir: intermediate representation
+    :param wrap: wrap output as a complete document
+    :param content_root: content tree of the document
+    :return: true if some output was produced
+    """
+    temporary_path: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with temporary_path.open("w", encoding="utf-8") as output_file:
+            converter.convert_ir(
+                ir, wrap=wrap, output=output_file, content_root=content_root
+            )
+            if not output_file.tell():
+                logger.fatal("No output was produced.")
+                return False
+        temporary_path.replace(path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+    return True
+
+
+def build_command(arguments: list[str], top_class: type[Moire] | None) -> None:
+    """Convert all Moire files of a directory.
+
+    :param arguments: command line arguments after `build`
+    :param top_class: base class of converters
+    """
+    from moire.build import build, find_sources  # noqa: PLC0415
+
+    parser: ArgumentParser = ArgumentParser(prog="moire build")
+
+    parser.add_argument("source", help="directory with Moire files")
+    parser.add_argument("output", help="directory for converted files")
+    parser.add_argument("-f", "--format", help="output format", required=True)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of processes, the number of processors by default",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="convert all files, even if they are not changed",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="convert changed files again on every change in the directory",
+    )
+
+    options: Namespace = parser.parse_args(arguments)
+
+    class_: type[Moire] | None = get_converter_class(top_class, options.format)
+    if not class_:
         logger.fatal(
             "No converter class found for format `%s`.", options.format
         )
         sys.exit(1)
 
-    with Path(options.input).open(encoding="utf-8") as input_file:
-        if converter is not None:  # TODO(enzet): remove when ty is fixed.
-            converter.file_name = options.input
-            output: str = converter.convert(
-                input_file.read(), wrap=options.wrap
+    source: Path = Path(options.source)
+    output: Path = Path(options.output)
+
+    if options.watch:
+        from moire.watch import Watcher, watch  # noqa: PLC0415
+
+        def update() -> None:
+            """Build changed files."""
+            report: BuildReport = build(
+                source, output, class_, jobs=options.jobs, force=options.force
             )
+            # Only the first build may be forced, then the manifest is current.
+            options.force = False
+            logger.info(report.summary())
 
-    if not output:
-        logger.fatal("No output was produced.")
+        watch(
+            Watcher(lambda: [path for _, path in find_sources(source)]),
+            update,
+        )
+        return
+
+    report: BuildReport = build(
+        source, output, class_, jobs=options.jobs, force=options.force
+    )
+    logger.info(report.summary())
+    if report.failed:
         sys.exit(1)
 
-    if options.output:
-        with Path(options.output).open("w", encoding="utf-8") as output_file:
-            output_file.write(output)
-            logger.info("Converted to %s.", options.output)
-    else:
-        sys.stdout.write(output)
+
+def serve_command(arguments: list[str], top_class: type[Moire] | None) -> None:
+    """Run conversion server.
+
+    :param arguments: command line arguments after `serve`
+    :param top_class: base class of converters
+    """
+    import asyncio  # noqa: PLC0415
+    import contextlib  # noqa: PLC0415
+
+    from moire.server import DEFAULT_HOST, DEFAULT_PORT, Server  # noqa: PLC0415
+
+    parser: ArgumentParser = ArgumentParser(prog="moire serve")
+
+    parser.add_argument("--host", default=DEFAULT_HOST, help="host to listen")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="port to listen"
+    )
+    parser.add_argument(
+        "--socket", help="Unix socket to listen instead of the port"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of processes, the number of processors by default",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="maximum number of simultaneous conversions, the number of "
+        "processes by default",
+    )
+
+    options: Namespace = parser.parse_args(arguments)
+
+    classes: dict[str, type[Moire]] = get_converter_classes(top_class)
+
+    async def serve() -> None:
+        """Create server in the event loop and run it."""
+        server: Server = Server(classes, jobs=options.jobs, limit=options.limit)
+        await server.serve(options.host, options.port, options.socket)
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve())
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:], Default)
+    main(sys.argv[1:])
@@ -0,0 +1,416 @@
+"""Batch conversion of directories with Moire files.
+
+All Moire files of the source directory are converted into the output
+directory with the same layout.  Files are converted by a pool of processes,
+errors are reported per file and do not stop the build.
+
+Builds are incremental: the manifest of the format in the output directory
+records the source hashes and the converters of the outputs, so only changed
+files are converted again, and outputs of removed sources are deleted.
+Manifests of formats are separate, so that several formats may be built into
+one directory.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from moire.moire import PARSER_VERSION
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from moire.moire import Moire
+
+__author__: str = "Sergey Vartanov"
+__email__: str = "me@enzet.ru"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SOURCE_SUFFIX: str = ".moi"
+MANIFEST_NAME: str = ".moire-manifest.{}.json"
+"""Name of the manifest file, with a placeholder for the format identifier."""
+MANIFEST_VERSION: int = 1
+TASKS_PER_PROCESS: int = 4
+"""Number of task chunks per process: larger chunks reduce communication
+between processes, smaller ones balance the load."""
+
+
+@dataclass
+class FileResult:
+    """Result of conversion of one file."""
+
+    source: Path
+    """Source file."""
+
+    size: int = 0
+    """Size of the source file in bytes."""
+
+    error: str | None = None
+    """Error message if the file was not converted."""
+
+
+@dataclass
+class ManifestEntry:
+    """Record of a converted source file."""
+
+    hash: str
+    """SHA-256 hash of the source file content."""
+
+    size: int
+    """Size of the source file in bytes."""
+
+    mtime: int
+    """Modification time of the source file in nanoseconds.  If the size and
+    the time are not changed, the file is not hashed again."""
+
+    format: str
+    """Output format identifier."""
+
+    converter: str
+    """Qualified name of the converter class."""
+
+    version: str
+    """Versions of the parser and the converter."""
+
+    output: str
+    """Path of the output file relative to the output directory."""
+
+    def is_current(self, other: ManifestEntry) -> bool:
+        """Check if the output of the entry is the output for the other one.
+
+        Source hashes are not compared.
+        """
+        return (
+            self.format == other.format
+            and self.converter == other.converter
+            and self.version == other.version
+            and self.output == other.output
+        )
+
+
+@dataclass
+class BuildReport:
+    """Summary of the build."""
+
+    converted: int = 0
+    """Number of converted files."""
+
+    size: int = 0
+    """Total size of converted source files in bytes."""
+
+    failed: list[FileResult] = field(default_factory=list)
+    """Files that were not converted."""
+
+    skipped: int = 0
+    """Number of files with up-to-date outputs."""
+
+    removed: int = 0
+    """Number of deleted outputs of removed sources."""
+
+    seconds: float = 0.0
+    """Duration of the build."""
+
+    def add(self, result: FileResult) -> None:
+        """Account the result of file conversion."""
+        if result.error is None:
+            self.converted += 1
+            self.size += result.size
+        else:
+            self.failed.append(result)
+
+    def summary(self) -> str:
+        """Get text with the number of files and the throughput."""
+        seconds: float = max(self.seconds, 1e-9)
+        text: str = (
+            f"Converted {self.converted} files, {self.size / 1e6:.1f} MB, "
+            f"in {self.seconds:.2f} s: {self.converted / seconds:.1f} files/s, "
+            f"{self.size / 1e6 / seconds:.2f} MB/s."
+        )
+        if self.skipped:
+            text += f" Up to date: {self.skipped}."
+        if self.removed:
+            text += f" Removed: {self.removed}."
+        if self.failed:
+            text += f" Failed: {len(self.failed)}."
+        return text
+
+
+def get_hash(path: Path) -> str:
+    """Get SHA-256 hash of the file content."""
+    with path.open("rb") as input_file:
+        return hashlib.file_digest(input_file, "sha256").hexdigest()
+
+
+def load_manifest(path: Path) -> dict[str, ManifestEntry]:
+    """Read manifest entries by source paths.
+
+    :param path: manifest file
+    :return: entries, empty if the manifest does not exist, is broken, or has
+        another version
+    """
+    try:
+        data: Any = json.loads(path.read_text(encoding="utf-8"))
+        if data["version"] != MANIFEST_VERSION:
+            return {}
+        return {
+            source: ManifestEntry(**entry)
+            for source, entry in data["entries"].items()
+        }
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def save_manifest(path: Path, entries: dict[str, ManifestEntry]) -> None:
+    """Write manifest.
+
+    The file is written to a temporary place first and then moved, so that
+    an interrupted build does not leave a partial manifest.
+
+    :param path: manifest file
+    :param entries: entries by source paths
+    """
+    data: dict[str, Any] = {
+        "version": MANIFEST_VERSION,
+        "entries": {
+            source: asdict(entry) for source, entry in sorted(entries.items())
+        },
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, suffix=".tmp", delete=False
+    ) as temporary_file:
+        json.dump(data, temporary_file)
+    Path(temporary_file.name).replace(path)
+
+
+def find_sources(root: Path) -> Iterator[tuple[str, str]]:
+    """Find Moire files in the directory and its subdirectories.
+
+    :param root: source directory
+    :return: paths relative to the directory, with `/` separators, and full
+        paths of the files
+    """
+    for directory, directories, files in os.walk(root):
+        directories.sort()
+        prefix: str = os.path.relpath(directory, root).replace(os.sep, "/")
+        prefix = "" if prefix == "." else f"{prefix}/"
+        for name in sorted(files):
+            if name.endswith(SOURCE_SUFFIX):
+                yield prefix + name, os.path.join(directory, name)  # noqa: PTH118
+
+
+def get_output_name(source: str, class_: type[Moire]) -> str:
+    """Get path of the converted file relative to the output directory.
+
+    :param source: path of the Moire file relative to the source directory
+    :param class_: converter, its first typical extension is used
+    """
+    name: str = source.removesuffix(SOURCE_SUFFIX)
+    if class_.extensions:
+        return f"{name}.{class_.extensions[0]}"
+    return name
+
+
+def convert_file(
+    class_: type[Moire], source: Path, output: Path, *, wrap: bool = True
+) -> FileResult:
+    """Convert one Moire file.
+
+    Output file is written only if conversion succeeds.
+
+    :param class_: converter
+    :param source: Moire file
+    :param output: path of the converted file
+    """
+    result: FileResult = FileResult(source)
+    try:
+        text: str = source.read_text(encoding="utf-8")
+        result.size = len(text.encode("utf-8", "surrogatepass"))
+        converter: Moire = class_()
+        converter.file_name = str(source)
+        converted: str = converter.convert(text, wrap=wrap)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(converted, encoding="utf-8")
+    except Exception as error:  # noqa: BLE001
+        # Any error of a converter or of the file system fails only this file.
+        result.error = f"{type(error).__name__}: {error}"
+    return result
+
+
+def convert_files(
+    class_: type[Moire], tasks: list[tuple[Path, Path]], *, wrap: bool = True
+) -> list[FileResult]:
+    """Convert several Moire files in one process.
+
+    :param class_: converter
+    :param tasks: pairs of source and output paths
+    """
+    return [
+        convert_file(class_, source, output, wrap=wrap)
+        for source, output in tasks
+    ]
+
+
+def build(
+    source_root: Path,
+    output_root: Path,
+    class_: type[Moire],
+    *,
+    jobs: int | None = None,
+    wrap: bool = True,
+    force: bool = False,
+) -> BuildReport:
+    """Convert changed Moire files of the directory.
+
+    A file is converted if its content, the converter, or the output path
+    changed since the previous build of the format, or if the output does not
+    exist.  Outputs of the format for sources that were removed are deleted.
+
+    :param source_root: directory with Moire files
+    :param output_root: directory for converted files, created if needed
+    :param class_: converter
+    :param jobs: number of processes, the number of processors by default;
+        if it is 1, files are converted in the current process
+    :param force: convert all files, even if their outputs are up to date
+    """
+    start: float = time.perf_counter()
+    manifest_path: Path = output_root / MANIFEST_NAME.format(class_.id_)
+    # The manifest is loaded even if the build is forced, so that outputs of
+    # removed sources are deleted.
+    previous: dict[str, ManifestEntry] = load_manifest(manifest_path)
+    entries: dict[str, ManifestEntry] = {}
+    outputs: set[str] = set()
+    report: BuildReport = BuildReport()
+
+    # Entries of the files to convert, by source paths.
+    pending: dict[Path, tuple[str, ManifestEntry]] = {}
+    tasks: list[tuple[Path, Path]] = []
+    # Results of files that cannot be read, by source paths.
+    unreadable: dict[str, FileResult] = {}
+
+    converter: str = f"{class_.__module__}.{class_.__qualname__}"
+    version: str = f"{PARSER_VERSION}.{class_.version}"
+
+    for key, path in find_sources(source_root):
+        # Paths are handled as strings: `pathlib` is too slow for thousands
+        # of files that are mostly up to date.
+        source: Path = Path(path)
+        output_name: str = get_output_name(key, class_)
+        output: str = os.path.join(output_root, output_name)  # noqa: PTH118
+        outputs.add(output_name)
+        old: ManifestEntry | None = previous.get(key)
+
+        try:
+            stat: os.stat_result = os.stat(path)  # noqa: PTH116
+            entry: ManifestEntry = ManifestEntry(
+                "",
+                stat.st_size,
+                stat.st_mtime_ns,
+                class_.id_,
+                converter,
+                version,
+                output_name,
+            )
+            if (
+                not force
+                and old is not None
+                and old.is_current(entry)
+                and os.path.exists(output)  # noqa: PTH110
+            ):
+                if old.size == entry.size and old.mtime == entry.mtime:
+                    entries[key] = old
+                    report.skipped += 1
+                    continue
+                entry.hash = get_hash(source)
+                if old.hash == entry.hash:
+                    entries[key] = entry
+                    report.skipped += 1
+                    continue
+            else:
+                entry.hash = get_hash(source)
+        except OSError as error:
+            # Unreadable sources, such as broken links, fail only themselves.
+            unreadable[key] = FileResult(
+                source, error=f"{type(error).__name__}: {error}"
+            )
+            continue
+
+        pending[source] = key, entry
+        tasks.append((source, Path(output)))
+
+    for key, result in unreadable.items():
+        logger.error("Error in `%s`: %s", result.source, result.error)
+        if key in previous:
+            entries[key] = previous[key]
+        report.add(result)
+
+    for result in run_tasks(class_, tasks, jobs=jobs, wrap=wrap):
+        key, entry = pending[result.source]
+        if result.error is None:
+            entries[key] = entry
+        else:
+            logger.error("Error in `%s`: %s", result.source, result.error)
+            # The previous output is kept, the entry is kept to delete it
+            # when the source is removed.
+            if key in previous:
+                entries[key] = previous[key]
+        report.add(result)
+
+    for old in previous.values():
+        if old.output not in outputs:
+            with contextlib.suppress(FileNotFoundError):
+                (output_root / old.output).unlink()
+                report.removed += 1
+
+    save_manifest(manifest_path, entries)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def run_tasks(
+    class_: type[Moire],
+    tasks: list[tuple[Path, Path]],
+    *,
+    jobs: int | None = None,
+    wrap: bool = True,
+) -> Iterator[FileResult]:
+    """Convert files, in a pool of processes if there are several jobs.
+
+    Tasks are split into chunks, so that processes are not contacted for each
+    file.  Results are yielded in the order of tasks.
+
+    :param class_: converter
+    :param tasks: pairs of source and output paths
+    :param jobs: number of processes, the number of processors by default
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(tasks))
+
+    if jobs <= 1:
+        for source, output in tasks:
+            yield convert_file(class_, source, output, wrap=wrap)
+        return
+
+    chunk_size: int = max(1, len(tasks) // (jobs * TASKS_PER_PROCESS))
+    chunks: list[list[tuple[Path, Path]]] = [
+        tasks[index : index + chunk_size]
+        for index in range(0, len(tasks), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for results in executor.map(
+            partial(convert_files, class_, wrap=wrap), chunks
+        ):
+            yield from results
@@ -0,0 +1,274 @@
+"""Persistent cache of intermediate representations.
+
+Parsed representations and outlines, see `moire.moire.get_outline`, are stored
+in a directory, one file per source text and kind of data, keyed by the hash of
+the text and the parser version.  The least recently used entries are removed
+when the total size exceeds the limit.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import gc
+import hashlib
+import logging
+import marshal
+import tempfile
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from moire.moire import PARSER_VERSION, Tag
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+__author__: str = "Sergey Vartanov"
+__email__: str = "me@enzet.ru"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX: str = ".ir"
+OUTLINE_KIND: str = "outline"
+DEFAULT_CACHE_SIZE: int = 1 << 28
+"""Default limit of the total cache size in bytes."""
+
+T = TypeVar("T")
+
+
+def encode_ir(ir: list[Any]) -> list[Any]:
+    """Flatten intermediate representation into a list of codes.
+
+    Strings are stored as they are, a list is stored as the number of its
+    elements followed by the elements, and a tag with `n` parameters is stored
+    as `-1 - n` followed by the tag name and the parameters.  Nested elements
+    are traversed without recursion.
+
+    :param ir: intermediate representation
+    """
+    codes: list[Any] = []
+    stack: list[Any] = [ir]
+
+    while stack:
+        element: Any = stack.pop()
+        if isinstance(element, str):
+            codes.append(element)
+        elif isinstance(element, list):
+            codes.append(len(element))
+            stack.extend(reversed(element))
+        elif isinstance(element, Tag):
+            codes.append(-1 - len(element.parameters))
+            codes.append(element.id)
+            stack.extend(reversed(element.parameters))
+        else:
+            message: str = f"Cannot encode element of type `{type(element)}`."
+            raise TypeError(message)
+
+    return codes
+
+
+def decode_ir(codes: list[Any]) -> list[Any]:
+    """Restore intermediate representation from the list of codes.
+
+    The representation has no reference cycles, so garbage collection, which
+    otherwise takes most of the time here, is paused.
+
+    :param codes: codes produced by `encode_ir`
+    """
+    is_enabled: bool = gc.isenabled()
+    gc.disable()
+    try:
+        return decode_codes(codes)
+    finally:
+        if is_enabled:
+            gc.enable()
+
+
+def decode_codes(codes: list[Any]) -> list[Any]:
+    """Restore intermediate representation from the list of codes."""
+    stack: list[tuple[list[Any], int, str | None]] = []
+    elements: list[Any] = []
+    remaining: int = codes[0]
+    name: str | None = None
+    index: int = 1
+
+    while True:
+        while not remaining:
+            finished: Any = elements if name is None else Tag(name, elements)
+            if not stack:
+                return finished  # type: ignore[no-any-return]
+            elements, remaining, name = stack.pop()
+            elements.append(finished)
+
+        code: Any = codes[index]
+        index += 1
+        remaining -= 1
+
+        if isinstance(code, str):
+            elements.append(code)
+        elif code >= 0:
+            stack.append((elements, remaining, name))
+            elements, remaining, name = [], code, None
+        else:
+            stack.append((elements, remaining, name))
+            elements, remaining, name = [], -1 - code, codes[index]
+            index += 1
+
+
+class IRCache:
+    """Directory with serialized intermediate representations."""
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """Create cache.
+
+        :param path: cache directory, created if it does not exist
+        :param max_size: limit of the total size of cache files in bytes
+        """
+        self.path: Path = path
+        self.max_size: int = max_size
+
+        # Cache entries from the least to the most recently used with their
+        # sizes, read from the directory on first use.
+        self.entries: OrderedDict[str, int] | None = None
+        self.size: int = 0
+
+    @staticmethod
+    def get_key(text: str, kind: str = "") -> str:
+        """Get cache key for the source text.
+
+        :param text: source text
+        :param kind: kind of cached data, empty for intermediate
+            representation
+        """
+        prefix: str = f"{kind}\0" if kind else ""
+        version: bytes = f"{prefix}{PARSER_VERSION}\0".encode()
+        data: bytes = text.encode("utf-8", "surrogatepass")
+        return hashlib.sha256(version + data).hexdigest()
+
+    def load_entries(self) -> OrderedDict[str, int]:
+        """Read cache entries from the directory."""
+        if self.entries is not None:
+            return self.entries
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        found: list[tuple[float, str, int]] = []
+        for path in self.path.glob(f"*{CACHE_SUFFIX}"):
+            with contextlib.suppress(FileNotFoundError):
+                stat = path.stat()
+                found.append((stat.st_mtime, path.stem, stat.st_size))
+
+        self.entries = OrderedDict(
+            (key, size) for _, key, size in sorted(found)
+        )
+        self.size = sum(self.entries.values())
+        return self.entries
+
+    def get(self, text: str) -> list[Any] | None:
+        """Get cached intermediate representation of the text.
+
+        :param text: source text
+        :return: representation or `None` if it is not in the cache
+        """
+        return self.load(self.get_key(text), decode_ir)
+
+    def put(self, text: str, ir: list[Any]) -> None:
+        """Store intermediate representation of the text.
+
+        :param text: source text
+        :param ir: intermediate representation of the text
+        """
+        self.store(self.get_key(text), encode_ir(ir))
+
+    def get_outline(self, text: str) -> list[tuple[str, int]] | None:
+        """Get cached header and label identifiers of the text.
+
+        :param text: source text
+        :return: list of tuples (id, level) or `None` if it is not in the
+            cache
+        """
+        return self.load(
+            self.get_key(text, OUTLINE_KIND),
+            lambda data: [(str(id_), int(level)) for id_, level in data],
+        )
+
+    def put_outline(self, text: str, ids: list[tuple[str, int]]) -> None:
+        """Store header and label identifiers of the text.
+
+        Outlines with identifiers that are not plain text are not stored.
+
+        :param text: source text
+        :param ids: list of tuples (id, level), see `Moire.get_ids`
+        """
+        if all(isinstance(id_, str) for id_, _ in ids):
+            self.store(self.get_key(text, OUTLINE_KIND), ids)
+
+    def load(self, key: str, decode: Callable[[Any], T]) -> T | None:
+        """Read cache entry.
+
+        :param key: cache key
+        :param decode: function that restores the value from unmarshalled
+            data
+        :return: value or `None` if it is not in the cache
+        """
+        entries: OrderedDict[str, int] = self.load_entries()
+        path: Path = self.path / (key + CACHE_SUFFIX)
+
+        try:
+            data: bytes = path.read_bytes()
+        except FileNotFoundError:
+            self.forget(key)
+            return None
+
+        # Cache directory is written only by the cache itself, so its content
+        # is trusted.
+        try:
+            data = zlib.decompress(data)
+            value: T = decode(marshal.loads(data))  # noqa: S302
+        except (zlib.error, ValueError, EOFError, TypeError, IndexError):
+            logger.warning("Removing broken cache entry `%s`.", path)
+            path.unlink(missing_ok=True)
+            self.forget(key)
+            return None
+
+        with contextlib.suppress(OSError):
+            path.touch()
+        if key in entries:
+            entries.move_to_end(key)
+        return value
+
+    def store(self, key: str, value: Any) -> None:
+        """Write cache entry.
+
+        The file is written to a temporary place first and then moved, so
+        that concurrent readers never see a partial entry.
+
+        :param key: cache key
+        :param value: data that can be marshalled
+        """
+        entries: OrderedDict[str, int] = self.load_entries()
+        data: bytes = zlib.compress(marshal.dumps(value))
+
+        with tempfile.NamedTemporaryFile(
+            dir=self.path, suffix=".tmp", delete=False
+        ) as temporary_file:
+            temporary_file.write(data)
+        Path(temporary_file.name).replace(self.path / (key + CACHE_SUFFIX))
+
+        self.forget(key)
+        entries[key] = len(data)
+        self.size += len(data)
+        self.evict()
+
+    def forget(self, key: str) -> None:
+        """Remove the entry from the index."""
+        if self.entries is not None and key in self.entries:
+            self.size -= self.entries.pop(key)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries above the size limit."""
+        entries: OrderedDict[str, int] = self.load_entries()
+        while self.size > self.max_size and entries:
+            key, size = entries.popitem(last=False)
+            self.size -= size
+            (self.path / (key + CACHE_SUFFIX)).unlink(missing_ok=True)
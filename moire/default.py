@@ -3,13 +3,12 @@
 import logging
 import sys
 from abc import ABC, abstractmethod
-from argparse import ArgumentParser, Namespace
 from dataclasses import dataclass, field
-from pathlib import Path
+from io import StringIO
 from textwrap import dedent
 from typing import Any, ClassVar, override
 
-from moire.moire import Moire
+from moire.moire import Moire, Output, Writer
 
 __author__ = "Sergey Vartanov"
 __email__ = "me@enzet.ru"
@@ -34,6 +33,39 @@ class TagNotImplementedError(NotImplementedError):
         return rf"Tag \{self.tag} is not implemented in the parser"
 
 
+def collapse_empty_lines(text: str) -> str:
+    """Replace triple newlines with double ones, twice."""
+    return text.replace("\n\n\n", "\n\n").replace("\n\n\n", "\n\n")
+
+
+class EmptyLineWriter:
+    """Writer that collapses newlines with `collapse_empty_lines`.
+
+    Trailing newlines of a fragment are held back until the next fragment, so
+    that newlines split between fragments are collapsed as in joined text.
+    """
+
+    def __init__(self, output: Writer) -> None:
+        self.output: Writer = output
+        self.newlines: str = ""
+        """Newlines at the end of the written text, not yet written."""
+
+    def write(self, text: str, /) -> int:
+        """Write a fragment of the output."""
+        stripped: str = text.rstrip("\n")
+        if not stripped:
+            self.newlines += text
+            return len(text)
+        self.output.write(collapse_empty_lines(self.newlines + stripped))
+        self.newlines = text[len(stripped) :]
+        return len(text)
+
+    def flush(self) -> None:
+        """Write held back newlines."""
+        self.output.write(collapse_empty_lines(self.newlines))
+        self.newlines = ""
+
+
 @dataclass
 class Default(Moire, ABC):
     """Default tag declaration."""
@@ -229,26 +261,35 @@ class DefaultHTML(Default):
 
     @override
     def body(self, arg: Arguments) -> str:
+        output: StringIO = StringIO()
+        self.stream_body(arg, output)
+        return output.getvalue()
+
+    def stream_body(self, arg: Arguments, output: Writer) -> None:
+        """Write body of the document."""
         status["content"] = []
-        s: str = dedent(
-            """
-            <html>
-                <head>
-                    <meta http-equiv="Content-Type" content="text/html;
-                        charset=utf-8">
-                    <link rel="stylesheet" href="style.css">
-                </head>
-                <body>
-            """
+        output.write(
+            dedent(
+                """
+                <html>
+                    <head>
+                        <meta http-equiv="Content-Type" content="text/html;
+                            charset=utf-8">
+                        <link rel="stylesheet" href="style.css">
+                    </head>
+                    <body>
+                """
+            )
         )
-        s += self.parse(arg[0], in_block=True)
-        s += dedent(
-            """
-                </body>
-            </html>
-            """
+        self.stream(arg[0], output, in_block=True)
+        output.write(
+            dedent(
+                """
+                    </body>
+                </html>
+                """
+            )
         )
-        return s
 
     # Metadata tags.
 
@@ -317,15 +358,14 @@ class DefaultHTML(Default):
 
     @override
     def table(self, arg: Arguments) -> str:
-        result: str = ""
-
+        result: Output = Output("<table>")
         for row in arg:
-            cells: str = "".join(
-                [f"<td>{self.parse(cell, in_block=True)}</td>" for cell in row]
-            )
-            result += f"<tr>{cells}</tr>"
-
-        return f"<table>{result}</table>"
+            result.add("<tr>")
+            for cell in row:
+                result.add("<td>", self.parse(cell, in_block=True), "</td>")
+            result.add("</tr>")
+        result.add("</table>")
+        return result.build()
 
     @override
     def image(self, arg: Arguments) -> str:
@@ -361,14 +401,21 @@ class DefaultText(Default):
 
     name: ClassVar[str] = "Text"
     id_: ClassVar[str] = "text"
-    extension: ClassVar[str] = "txt"
+    extensions: ClassVar[list[str]] = ["txt"]
     escape_symbols: ClassVar[dict[str, str]] = {}
 
     # Main methods.
 
     @override
     def body(self, arg: Arguments) -> str:
-        return self.parse(arg[0], in_block=True, depth=1) + "\n"
+        output: StringIO = StringIO()
+        self.stream_body(arg, output)
+        return output.getvalue()
+
+    def stream_body(self, arg: Arguments, output: Writer) -> None:
+        """Write body of the document."""
+        self.stream(arg[0], output, in_block=True)
+        output.write("\n")
 
     # Metadata tags.
 
@@ -431,19 +478,21 @@ class DefaultText(Default):
 
     @override
     def list__(self, arg: Arguments) -> str:
-        result: str = ""
+        result: Output = Output()
         for item in arg:
             if isinstance(item, list):
-                result += "  * " + self.parse(
-                    item, in_block=True, depth=depth + 1
+                result.add(
+                    "  * ", self.parse(item, in_block=True, depth=depth + 1)
                 )
-        return result
+        return result.build()
 
     @override
     def table(self, arg: Arguments) -> str:
         widths: list[int] = []
+        rows: list[list[str]] = []
         for row in arg:
             cells: list[str] = [self.parse(cell) for cell in row]
+            rows.append(cells)
             for index, cell in enumerate(cells):
                 if len(widths) - 1 < index:
                     widths.append(len(cell))
@@ -452,16 +501,15 @@ class DefaultText(Default):
 
         ruler: str = "+" + "+".join(["-" * (x + 2) for x in widths]) + "+"
 
-        result: str = ruler + "\n"
-        for row in arg:
-            result += "|"
-            for index, cell in enumerate(row):
-                parsed: str = self.parse(cell)
-                result += f" {parsed} " * (widths[index] - len(parsed)) + " |"
-            result += "\n"
-        result += ruler + "\n"
+        result: Output = Output(ruler, "\n")
+        for cells in rows:
+            result.add("|")
+            for index, parsed in enumerate(cells):
+                result.add(f" {parsed} " * (widths[index] - len(parsed)), " |")
+            result.add("\n")
+        result.add(ruler, "\n")
 
-        return result
+        return result.build()
 
     @override
     def image(self, arg: Arguments) -> str:
@@ -487,6 +535,7 @@ class DefaultMarkdown(Default):
     id_: ClassVar[str] = "markdown"
     extensions: ClassVar[list[str]] = ["md", "markdown"]
     block_tags: ClassVar[set[str]] = BLOCK_TAGS
+    stateful_tags: ClassVar[set[str]] = Default.stateful_tags | {"list"}
 
     def __init__(
         self, *, is_html: bool = True, is_github_flavored: bool = False
@@ -507,12 +556,15 @@ class DefaultMarkdown(Default):
 
     @override
     def body(self, arg: Arguments) -> str:
-        # TODO(enzet): rewrite.
-        return (
-            self.parse(arg[0], in_block=True)
-            .replace("\n\n\n", "\n\n")
-            .replace("\n\n\n", "\n\n")
-        )
+        output: StringIO = StringIO()
+        self.stream_body(arg, output)
+        return output.getvalue()
+
+    def stream_body(self, arg: Arguments, output: Writer) -> None:
+        """Write body of the document."""
+        writer: EmptyLineWriter = EmptyLineWriter(output)
+        self.stream(arg[0], writer, in_block=True)
+        writer.flush()
 
     # Metadata tags.
 
@@ -606,21 +658,21 @@ class DefaultMarkdown(Default):
 
     @override
     def table(self, arg: Arguments) -> str:
-        result: str = ""
+        result: Output = Output()
         for index, row in enumerate(arg):
             if isinstance(row, list):
-                result += "|"
+                result.add("|")
                 for cell in row:
                     if isinstance(cell, list):
-                        result += f" {self.parse(cell)} |"
-                result += "\n"
+                        result.add(" ", self.parse(cell), " |")
+                result.add("\n")
                 if index == 0:
-                    result += "|"
+                    result.add("|")
                     for cell in row:
                         if isinstance(cell, list):
-                            result += "---|"
-                    result += "\n"
-        return result
+                            result.add("---|")
+                    result.add("\n")
+        return result.build()
 
     @override
     def image(self, arg: Arguments) -> str:
@@ -655,11 +707,15 @@ class DefaultWiki(Default):
 
     @override
     def body(self, arg: Arguments) -> str:
-        return (
-            self.parse(arg[0], in_block=True)
-            .replace("\n\n\n", "\n\n")
-            .replace("\n\n\n", "\n\n")
-        )
+        output: StringIO = StringIO()
+        self.stream_body(arg, output)
+        return output.getvalue()
+
+    def stream_body(self, arg: Arguments, output: Writer) -> None:
+        """Write body of the document."""
+        writer: EmptyLineWriter = EmptyLineWriter(output)
+        self.stream(arg[0], writer, in_block=True)
+        writer.flush()
 
     # Metadata tags.
 
@@ -722,23 +778,24 @@ class DefaultWiki(Default):
 
     @override
     def list__(self, arg: Arguments) -> str:
-        result: str = ""
+        result: Output = Output()
         for item in arg:
             if isinstance(item, list):
-                result += f"* {self.parse(item)}\n"
-        return result
+                result.add("* ", self.parse(item), "\n")
+        return result.build()
 
     @override
     def table(self, arg: Arguments) -> str:
-        result: str = (
+        result: Output = Output(
             '{| class="wikitable" border="1" cellspacing="0" cellpadding="2"\n'
             "! Tag || Rendering\n"
         )
         for row in arg:
-            result += "|-\n"
+            result.add("|-\n")
             for cell in row:
-                result += f"| {self.parse(cell)}\n"
-        return result + "|}\n"
+                result.add("| ", self.parse(cell), "\n")
+        result.add("|}\n")
+        return result.build()
 
     @override
     def image(self, arg: Arguments) -> str:
@@ -767,7 +824,7 @@ class DefaultTeX(Default):
 
     name: ClassVar[str] = "Tex"
     id_: ClassVar[str] = "tex"
-    extension: ClassVar[str] = "tex"
+    extensions: ClassVar[list[str]] = ["tex"]
 
     escape_symbols: ClassVar[dict[str, str]] = {"_": r"\_"}
     block_tags: ClassVar[set[str]] = BLOCK_TAGS
@@ -785,7 +842,13 @@ class DefaultTeX(Default):
 
     @override
     def body(self, arg: Arguments) -> str:
-        result: str = dedent(
+        output: StringIO = StringIO()
+        self.stream_body(arg, output)
+        return output.getvalue()
+
+    def stream_body(self, arg: Arguments, output: Writer) -> None:
+        """Write body of the document."""
+        header: str = dedent(
             r"""\
             \documentclass[twoside,psfig]{article}
             \usepackage[utf8]{inputenc}
@@ -800,9 +863,9 @@ class DefaultTeX(Default):
             \begin{document}
             """
         )
-        result += self.parse(arg[0], in_block=True)
-        result += r"\end{document}"
-        return result
+        output.write(header)
+        self.stream(arg[0], output, in_block=True)
+        output.write(r"\end{document}")
 
     # Metadata tags.
 
@@ -875,15 +938,17 @@ class DefaultTeX(Default):
 
     @override
     def list__(self, arg: Arguments) -> str:
-        result: str = "\\begin{itemize}\n"
+        result: Output = Output("\\begin{itemize}\n")
         for item in arg:
-            result += f"\\item {self.parse(item)}\n\n"
-        result += "\\end{itemize}\n"
-        return result
+            result.add("\\item ", self.parse(item), "\n\n")
+        result.add("\\end{itemize}\n")
+        return result.build()
 
     @override
     def table(self, arg: Arguments) -> str:
-        result: str = "\\begin{table}[h]\n\\begin{center}\n\\begin{tabular}"
+        result: Output = Output(
+            "\\begin{table}[h]\n\\begin{center}\n\\begin{tabular}"
+        )
 
         max_columns: int = 0
         for tr in arg:
@@ -894,7 +959,7 @@ class DefaultTeX(Default):
                         column_count += 1
                 max_columns = max(max_columns, column_count)
 
-        result += f"{{|{('l|' * max_columns)}}}\n\\hline\n"
+        result.add(f"{{|{('l|' * max_columns)}}}\n\\hline\n")
 
         for row in arg:
             if isinstance(row, list):
@@ -902,13 +967,12 @@ class DefaultTeX(Default):
                     column for column in row if isinstance(column, list)
                 ]
                 for column in columns[:-1]:
-                    result += self.parse(column) + " & "
-                result += self.parse(columns[-1])
-                result += " \\\\\n\\hline\n"
+                    result.add(self.parse(column), " & ")
+                result.add(self.parse(columns[-1]), " \\\\\n\\hline\n")
 
-        result += "\\end{tabular}\n\\end{center}\n\\end{table}\n"
+        result.add("\\end{tabular}\n\\end{center}\n\\end{table}\n")
 
-        return result
+        return result.build()
 
     @override
     def image(self, arg: Arguments) -> str:
@@ -929,12 +993,12 @@ class DefaultTeX(Default):
 
     def ordered(self, arg: Arguments) -> str:
         """Create an ordered list."""
-        result: str = "\\begin{ordered}\n"
+        result: Output = Output("\\begin{ordered}\n")
         for item in arg[0]:
             if isinstance(item, list):
-                result += f"\\item {self.parse(item[0])}\n\n"
-        result += "\\end{ordered}\n"
-        return result
+                result.add("\\item ", self.parse(item[0]), "\n\n")
+        result.add("\\end{ordered}\n")
+        return result.build()
 
     def abstract(self, arg: Arguments) -> str:
         """Create an abstract."""
@@ -946,15 +1010,17 @@ class DefaultTeX(Default):
 
     def books(self, arg: Arguments) -> str:
         """Create a bibliography."""
-        result: str = "\\begin{thebibliography}{0}\n\n"
+        result: Output = Output("\\begin{thebibliography}{0}\n\n")
         for item in arg[0]:
             if not isinstance(item, list):
                 continue
-            result += (
-                f"\\bibitem{{{self.clear(item[0])}}} {self.parse(item[1])}\n\n"
+            result.add(
+                f"\\bibitem{{{self.clear(item[0])}}} ",
+                self.parse(item[1]),
+                "\n\n",
             )
-        result += "\\end{thebibliography}\n\n"
-        return result
+        result.add("\\end{thebibliography}\n\n")
+        return result.build()
 
     @staticmethod
     def br(_: Arguments) -> str:
@@ -989,6 +1055,9 @@ class DefaultTeX(Default):
 
 
 if __name__ == "__main__":
+    from argparse import ArgumentParser, Namespace
+    from pathlib import Path
+
     logging.basicConfig(level=logging.INFO)
 
     parser: ArgumentParser = ArgumentParser()
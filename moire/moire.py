@@ -7,14 +7,23 @@ from __future__ import annotations
 
 import contextlib
 import logging
+import re
 import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Callable
 from dataclasses import dataclass, field
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 from io import StringIO
-from typing import TYPE_CHECKING, Any, ClassVar
+from itertools import accumulate
+from types import FunctionType
+from typing import TYPE_CHECKING, Any, ClassVar, Protocol
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Iterable, Iterator, Sequence
+
+    from moire.cache import IRCache
 
 __author__: str = "Sergey Vartanov"
 __email__: str = "me@enzet.ru"
@@ -48,6 +57,51 @@ class TokenType(Enum):
 
 SPACES: str = " \n\t\r"
 
+PARSER_VERSION: int = 1
+"""Version of the parser, changed when the intermediate representation of
+the same text changes."""
+
+CHUNK_SIZE: int = 1 << 16
+"""Number of characters read at once from file-like input."""
+
+# Characters that interrupt plain text and tag names for the span lexer.
+TEXT_BOUNDARY: re.Pattern[str] = re.compile(r"[\\{}]")
+TAG_BOUNDARY: re.Pattern[str] = re.compile(r"[\\{}" + re.escape(SPACES) + "]")
+SPACE_RUN: re.Pattern[str] = re.compile("[" + re.escape(SPACES) + "]+")
+# Text needs collapsing only if it contains two spaces in a row or a space
+# symbol other than " ".
+COLLAPSIBLE_SPACES: tuple[str, ...] = ("  ", *SPACES.replace(" ", ""))
+HEADER_DIGITS: str = "123456"
+HEADER_LEVELS: dict[str, int] = {
+    HEADER_DIGITS[start:end]: int(HEADER_DIGITS[start:end])
+    for start in range(len(HEADER_DIGITS))
+    for end in range(start + 1, len(HEADER_DIGITS) + 1)
+}
+r"""Header levels by tag names.  Header tags are named by consecutive digits
+from 1 to 6, e.g. `\2` or `\12`."""
+
+# First symbols of header and label tag names.
+OUTLINE_NAME_STARTS: str = HEADER_DIGITS + "l"
+OUTLINE_TAG: re.Pattern[str] = re.compile(
+    re.escape(Constant.TAG_MARKER.value) + f"[{OUTLINE_NAME_STARTS}]"
+)
+# Escaped ASCII symbols, see `get_outline`.
+ESCAPE: re.Pattern[str] = re.compile(r"\\[^A-Za-z0-9]")
+ESCAPE_MARK: str = "\0"
+BRACE: re.Pattern[str] = re.compile("[{}]")
+ELEMENT_END: re.Pattern[str] = re.compile(r"[\\{}" + ESCAPE_MARK + "]")
+NON_ASCII_ESCAPE: re.Pattern[str] = re.compile(r"\\[^\x00-\x7f]")
+
+# Paragraph delimiter and following newlines.
+PARAGRAPH_BREAK: re.Pattern[str] = re.compile(
+    re.escape(Constant.PARAGRAPH_DELIMITER.value) + "\n*"
+)
+COMMENT_MARKER: re.Pattern[str] = re.compile(
+    re.escape(Constant.COMMENT_BEGIN.value)
+    + "|"
+    + re.escape(Constant.COMMENT_END.value)
+)
+
 
 class Root:
     """Root tree element."""
@@ -64,35 +118,82 @@ class Root:
         return "\n".join(serialize(x) for x in self.elements)
 
 
-@dataclass
 class Tag:
     """Moire tag definition.
 
     Tag has name and parameters:
         <backslash><tag name> {<parameter 1>} ... {<parameter N>}.
+
+    Tags are immutable: identifiers are interned, so that equal tag names share
+    one string, and parameters are stored in a tuple.  The header level is
+    computed on creation, the structural hash is computed once, on first use.
     """
 
+    __slots__: ClassVar[tuple[str, ...]] = (
+        "_hash",
+        "id",
+        "level",
+        "parameters",
+    )
+
     id: str
-    parameters: list
+    """Tag name."""
+
+    level: int
+    """Header level, 0 if the tag is not a header."""
+
+    parameters: tuple[Any, ...]
+    """Tag parameters, each parameter is a list of elements."""
+
+    _hash: int | None
+
+    def __init__(
+        self,
+        id: str,  # noqa: A002
+        parameters: Iterable[Any] = (),
+    ) -> None:
+        set_id(self, sys.intern(id))
+        set_level(self, HEADER_LEVELS.get(id, 0))
+        set_parameters(self, tuple(parameters))
+        set_hash(self, None)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        message: str = f"cannot assign to field `{name}` of immutable tag"
+        raise AttributeError(message)
+
+    def __delattr__(self, name: str) -> None:
+        message: str = f"cannot delete field `{name}` of immutable tag"
+        raise AttributeError(message)
+
+    def __reduce__(self) -> tuple[type[Tag], tuple[str, tuple[Any, ...]]]:
+        return type(self), (self.id, self.parameters)
+
+    def __repr__(self) -> str:
+        return f"Tag(id={self.id!r}, parameters={list(self.parameters)!r})"
 
     def __eq__(self, other: object) -> bool:
-        if not isinstance(other, type(self)):
+        if self is other:
+            return True
+        if not isinstance(other, Tag):
             return False
-        if self.id != other.id:
+        if self.id is not other.id and self.id != other.id:
             return False
-        if len(self.parameters) != len(other.parameters):
+        if (
+            self._hash is not None
+            and other._hash is not None
+            and self._hash != other._hash
+        ):
             return False
-        for index, parameter in enumerate(self.parameters):
-            if parameter != other.parameters[index]:
-                return False
-        return True
+        return self.parameters == other.parameters
 
     def __hash__(self) -> int:
-        return hash((self.id, tuple(self.parameters)))
+        if self._hash is None:
+            return structural_hash(self)
+        return self._hash
 
     def is_header(self) -> bool:
         """Check if the tag is a header."""
-        return self.id in "123456"
+        return self.level > 0
 
     def serialize(self) -> str:
         """Serialize the tag into a text form."""
@@ -101,6 +202,56 @@ class Tag:
         )
 
 
+# Slot setters that bypass `Tag.__setattr__`.
+set_id: Callable[[Tag, str], None] = Tag.__dict__["id"].__set__
+set_level: Callable[[Tag, int], None] = Tag.__dict__["level"].__set__
+set_parameters: Callable[[Tag, tuple[Any, ...]], None] = Tag.__dict__[
+    "parameters"
+].__set__
+set_hash: Callable[[Tag, int | None], None] = Tag.__dict__["_hash"].__set__
+
+
+def structural_hash(element: Any) -> int:
+    """Get hash of an element consistent with the element equality.
+
+    Lists are hashed by their contents.  Nested elements are traversed without
+    recursion, and hashes of tags are cached in the tags.
+
+    :param element: string, tag, or list of elements
+    """
+    hashes: list[int] = []
+    stack: list[tuple[Any, bool]] = [(element, False)]
+
+    while stack:
+        node, is_ready = stack.pop()
+        children: Any
+        if isinstance(node, Tag):
+            if node._hash is not None:  # noqa: SLF001
+                hashes.append(node._hash)  # noqa: SLF001
+                continue
+            children = node.parameters
+        elif isinstance(node, list | tuple):
+            children = node
+        else:
+            hashes.append(hash(node))
+            continue
+
+        if not is_ready:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+
+        start: int = len(hashes) - len(children)
+        value: int = hash(tuple(hashes[start:]))
+        del hashes[start:]
+        if isinstance(node, Tag):
+            value = hash((node.id, value))
+            set_hash(node, value)
+        hashes.append(value)
+
+    return hashes[0]
+
+
 @dataclass
 class Lexeme:
     """Lexeme is a token of the input text."""
@@ -128,12 +279,30 @@ class Tree:
     number: int = 0
     """Number of the element."""
 
+    index: dict[str, IndexEntry] | None = None
+    """Headers and labels by their identifiers, set for the root only, see
+    `build_content_tree`."""
+
+
+@dataclass
+class IndexEntry:
+    """Header or label in the content table."""
+
+    node: Tree
+    """Node of the header or, for a label, of the header that contains it."""
+
+    level: int
+    """Header level, 0 for labels."""
+
+    position: int
+    """Index of the tag in the intermediate representation."""
+
 
 @dataclass
 class Argument:
     """Argument is a list of elements and a dictionary of specifications."""
 
-    array: list
+    array: Sequence[Any]
     """List of elements."""
 
     spec: dict[str, Any]
@@ -152,45 +321,373 @@ class Argument:
         return self.array[key]
 
 
+CHECKPOINT_BLOCK_SIZE: int = 256
+"""Maximum number of checkpoints in a block of `Checkpoints`."""
+
+
+def get_offset(checkpoint: tuple[int, int]) -> int:
+    """Get source offset of the checkpoint."""
+    return checkpoint[0]
+
+
+class Checkpoints:
+    """Source offsets and representation indices of top-level tags.
+
+    Checkpoints are stored in blocks, and each block has its own offset and
+    index shifts.  After an edit only the blocks around it are rebuilt, the
+    blocks after it are shifted as a whole, so the cost of the edit depends on
+    the number of blocks and not on the number of checkpoints.
+
+    See `IntermediateBuilder.checkpoints`.
+    """
+
+    def __init__(
+        self,
+        checkpoints: Sequence[tuple[int, int]] = (),
+        blocks: list[list[tuple[int, int]]] | None = None,
+        shifts: list[tuple[int, int]] | None = None,
+    ) -> None:
+        """Create checkpoints.
+
+        :param checkpoints: offsets and indices, used if there are no blocks
+        :param blocks: checkpoints without shifts of their blocks
+        :param shifts: offset and index shifts of the blocks
+        """
+        if blocks is None:
+            blocks = split_blocks(list(checkpoints))
+        self.blocks: list[list[tuple[int, int]]] = blocks
+        self.shifts: list[tuple[int, int]] = shifts or [(0, 0)] * len(blocks)
+
+        # Positions of the first checkpoints of the blocks.
+        self.starts: list[int] = [0, *accumulate(map(len, blocks))]
+        self.size: int = self.starts.pop()
+
+        # Shifted offsets of the first checkpoints of the blocks.
+        self.offsets: list[int] = [
+            block[0][0] + shift
+            for block, (shift, _) in zip(blocks, self.shifts, strict=True)
+        ]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        for block, (shift, index_shift) in zip(
+            self.blocks, self.shifts, strict=True
+        ):
+            for offset, index in block:
+                yield offset + shift, index + index_shift
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Checkpoints):
+            return NotImplemented
+        return list(self) == list(other)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __getitem__(self, position: int) -> tuple[int, int]:
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        block_number: int = bisect_right(self.starts, position) - 1
+        offset, index = self.blocks[block_number][
+            position - self.starts[block_number]
+        ]
+        shift, index_shift = self.shifts[block_number]
+        return offset + shift, index + index_shift
+
+    def bisect_left(self, offset: int) -> int:
+        """Get position of the first checkpoint at the offset or after it."""
+        block_number: int = bisect_left(self.offsets, offset) - 1
+        if block_number < 0:
+            return 0
+        return self.starts[block_number] + bisect_left(
+            self.blocks[block_number],
+            offset - self.shifts[block_number][0],
+            key=get_offset,
+        )
+
+    def bisect_right(self, offset: int) -> int:
+        """Get position of the first checkpoint after the offset."""
+        block_number: int = bisect_right(self.offsets, offset) - 1
+        if block_number < 0:
+            return 0
+        return self.starts[block_number] + bisect_right(
+            self.blocks[block_number],
+            offset - self.shifts[block_number][0],
+            key=get_offset,
+        )
+
+    def replace(
+        self,
+        start: int,
+        end: int,
+        checkpoints: list[tuple[int, int]],
+        shift: int,
+        index_shift: int,
+    ) -> Checkpoints:
+        """Get checkpoints with a range replaced and the rest shifted.
+
+        :param start: position of the first replaced checkpoint
+        :param end: position after the last replaced checkpoint
+        :param checkpoints: new checkpoints for the range
+        :param shift: offset shift of checkpoints after the range
+        :param index_shift: index shift of checkpoints after the range
+        """
+        if not self.blocks:
+            return Checkpoints(checkpoints)
+        end = min(end, self.size)
+
+        first: int = max(bisect_right(self.starts, start) - 1, 0)
+        last: int = max(bisect_right(self.starts, end) - 1, first)
+        last = min(last, len(self.blocks) - 1)
+
+        block_shift, block_index_shift = self.shifts[first]
+        middle: list[tuple[int, int]] = [
+            (offset + block_shift, index + block_index_shift)
+            for offset, index in self.blocks[first][
+                : start - self.starts[first]
+            ]
+        ]
+        middle += checkpoints
+
+        # Small rebuilt part is joined with the next block, so that blocks do
+        # not get smaller with every edit.
+        if len(middle) + self.starts[last] + len(
+            self.blocks[last]
+        ) - end < CHECKPOINT_BLOCK_SIZE // 2 and last + 1 < len(self.blocks):
+            last += 1
+
+        for number in range(first, last + 1):
+            block_shift, block_index_shift = self.shifts[number]
+            block_shift += shift
+            block_index_shift += index_shift
+            middle += [
+                (offset + block_shift, index + block_index_shift)
+                for offset, index in self.blocks[number][
+                    max(end - self.starts[number], 0) :
+                ]
+            ]
+
+        new_blocks: list[list[tuple[int, int]]] = split_blocks(middle)
+        return Checkpoints(
+            blocks=self.blocks[:first] + new_blocks + self.blocks[last + 1 :],
+            shifts=self.shifts[:first]
+            + [(0, 0)] * len(new_blocks)
+            + [
+                (offset + shift, index + index_shift)
+                for offset, index in self.shifts[last + 1 :]
+            ],
+        )
+
+
+def split_blocks(
+    checkpoints: list[tuple[int, int]],
+) -> list[list[tuple[int, int]]]:
+    """Split checkpoints into blocks of similar size for `Checkpoints`."""
+    if not checkpoints:
+        return []
+    count: int = -(-len(checkpoints) // CHECKPOINT_BLOCK_SIZE)
+    size: int = -(-len(checkpoints) // count)
+    return [
+        checkpoints[start : start + size]
+        for start in range(0, len(checkpoints), size)
+    ]
+
+
+@dataclass
+class ParseState:
+    """Parsed text that can be updated after edits with `Moire.update_state`."""
+
+    text: str
+    """Source text."""
+
+    ir: list[Any]
+    """Intermediate representation of the text."""
+
+    checkpoints: Checkpoints
+    """Source offsets and representation indices of top-level tags."""
+
+
 def trim_inside(text: str) -> str:
     """Replace all space symbol sequences with one space character."""
 
-    result: str = ""
-    index: int = 0
-    while index < len(text):
-        if text[index] in SPACES:
-            result += " "
-            while index < len(text) and text[index] in SPACES:
-                index += 1
-            continue
-        result += text[index]
-        index += 1
-    return result
+    if not any(spaces in text for spaces in COLLAPSIBLE_SPACES):
+        return text
+    return SPACE_RUN.sub(" ", text)
 
 
-def preprocess_comments(text: str) -> str:
-    """Text to text processing: comments removing."""
+class SourceMap:
+    """Compact mapping from offsets in text without comments to source offsets.
+
+    Stores one entry per kept segment of the source text: the offset where the
+    segment starts in the stripped text and how far it was shifted.
+    """
+
+    def __init__(self) -> None:
+        self.starts: list[int] = []
+        self.shifts: list[int] = []
+
+    def add(self, start: int, source_start: int) -> None:
+        """Register a segment starting at `start` in the stripped text."""
+        shift: int = source_start - start
+        if shift != (self.shifts[-1] if self.shifts else 0):
+            self.starts.append(start)
+            self.shifts.append(shift)
+
+    def to_source(self, offset: int) -> int:
+        """Get the source offset for an offset in the stripped text."""
+        index: int = bisect_right(self.starts, offset) - 1
+        if index < 0:
+            return offset
+        return offset + self.shifts[index]
+
+
+class CommentStripper:
+    """Comment removal for text that comes in chunks.
+
+    Comment markers are found in bulk, so the cost is linear in the text size
+    regardless of the number of comments. As before, `*/` outside of a comment
+    is removed too.
+    """
+
+    def __init__(self) -> None:
+        self.source_map: SourceMap = SourceMap()
+        """Map from the stripped text back to the source offsets."""
+
+        self.adding: bool = True
+        self.offset: int = 0
+        self.length: int = 0
+
+        # The last character of the previous chunk if it may start a marker.
+        self.carry: str = ""
+
+    def feed(self, chunk: str, *, final: bool = False) -> str:
+        """Get the chunk without comments.
+
+        :param chunk: next part of the source text
+        :param final: whether this is the last chunk
+        """
+        text: str = self.carry + chunk
+        offset: int = self.offset - len(self.carry)
+        self.carry = ""
 
-    preprocessed: str = ""
-    adding: bool = True
-    i: int = 0
-    while i < len(text):
         if (
-            text[i : i + len(Constant.COMMENT_BEGIN.value)]
-            == Constant.COMMENT_BEGIN.value
+            self.adding
+            and Constant.COMMENT_BEGIN.value not in text
+            and Constant.COMMENT_END.value not in text
+            and (final or not text.endswith(("/", "*")))
         ):
-            adding = False
-            i += 1
-        elif (
-            text[i : i + len(Constant.COMMENT_END.value)]
-            == Constant.COMMENT_END.value
-        ):
-            adding = True
-            i += 1
-        elif adding:
-            preprocessed += text[i]
-        i += 1
-    return preprocessed
+            self.source_map.add(self.length, offset)
+            self.offset += len(chunk)
+            self.length += len(text)
+            return text
+
+        parts: list[str] = []
+        adding: bool = self.adding
+        start: int = 0
+        end: int = len(text)
+
+        for match in COMMENT_MARKER.finditer(text):
+            if adding and match.start() > start:
+                self.source_map.add(self.length, offset + start)
+                parts.append(text[start : match.start()])
+                self.length += match.start() - start
+            adding = match.group() != Constant.COMMENT_BEGIN.value
+            start = match.end()
+
+        if not final and start < end and text[-1] in "/*":
+            self.carry = text[-1]
+            end -= 1
+
+        if adding and start < end:
+            self.source_map.add(self.length, offset + start)
+            parts.append(text[start:end])
+            self.length += end - start
+
+        self.adding = adding
+        self.offset += len(chunk)
+        return "".join(parts)
+
+
+def strip_comments(text: str) -> tuple[str, SourceMap]:
+    """Remove comments and get the map back to the source offsets."""
+    stripper: CommentStripper = CommentStripper()
+    return stripper.feed(text, final=True), stripper.source_map
+
+
+def preprocess_comments(text: str) -> str:
+    """Text to text processing: comments removing."""
+    return strip_comments(text)[0]
+
+
+def compile_escape(symbols: dict[str, str]) -> Callable[[str], str]:
+    """Get function that replaces special symbols in text.
+
+    The result is the same as of calling `str.replace` for each symbol in
+    order.  If all symbols and replacements are single characters and no
+    replacement contains a later symbol, text is translated in one pass.
+    Otherwise, only symbols that are present in the text are replaced, so
+    text without special symbols is returned as is after a few fast scans.
+
+    :param symbols: mapping from special symbols to their escaped forms
+    """
+    items: list[tuple[str, str]] = list(symbols.items())
+    keys: list[str] = [key for key, _ in items]
+
+    if not items:
+        return str
+
+    if all(
+        len(key) == 1
+        and len(value) <= 1
+        and not any(later in value for later in keys[index + 1 :])
+        for index, (key, value) in enumerate(items)
+    ):
+        table: dict[int, str] = str.maketrans(symbols)
+
+        def translate(text: str) -> str:
+            return text.translate(table)
+
+        return translate
+
+    def replace(text: str) -> str:
+        for key, value in items:
+            if key in text:
+                text = text.replace(key, value)
+        return text
+
+    return replace
+
+
+def split_paragraphs(elements: list[Any]) -> list[list[Any]]:
+    """Split elements into paragraphs.
+
+    Paragraphs are delimited by runs of two or more newlines inside text
+    elements.  Text before the first delimiter of a text element always
+    closes the current paragraph, even if it is empty.  Every text element is
+    scanned once.
+
+    :param elements: text elements and tags
+    """
+    paragraphs: list[list[Any]] = []
+    paragraph: list[Any] = []
+    delimiter: str = Constant.PARAGRAPH_DELIMITER.value
+
+    for element in elements:
+        if not isinstance(element, str) or delimiter not in element:
+            paragraph.append(element)
+            continue
+
+        previous: int = 0
+        for match in PARAGRAPH_BREAK.finditer(element):
+            paragraph.append(element[previous : match.start()])
+            paragraphs.append(paragraph)
+            paragraph = []
+            previous = match.end()
+        paragraph.append(element[previous:])
+
+    paragraphs.append(paragraph)
+    return paragraphs
 
 
 def is_letter_or_digit(char: str) -> bool:
@@ -267,53 +764,962 @@ def lexer(text: str) -> tuple[list[Lexeme], list[int]]:
     return lexemes, positions
 
 
-def get_intermediate(
-    lexemes: list[Lexeme], positions: list[int], level: int, index: int = 0
-) -> tuple[int, list[Any]]:
-    """Get intermediate representation."""
-
-    tag: Tag | None = None
-    result: list[Any] = []
-    while index < len(lexemes):
-        item = lexemes[index]
-        if item.type == "tag":
-            if tag:
-                result.append(tag)
-            if item.content is None:
-                message: str = "No content in tag lexeme."
-                raise ValueError(message)
-            tag = Tag(item.content, [])
-        elif item.type == "parameter_begin":
-            level += 1
-            if not tag:
-                index += 1
-                index, res = get_intermediate(lexemes, positions, level, index)
-                result.append(res)
+class LexemeType(IntEnum):
+    """Codes of lexeme types in `TokenStream`."""
+
+    TEXT = 0
+    SYMBOL = 1
+    TAG = 2
+    PARAMETER_BEGIN = 3
+    PARAMETER_END = 4
+
+
+TEXT: int = LexemeType.TEXT.value
+SYMBOL: int = LexemeType.SYMBOL.value
+TAG: int = LexemeType.TAG.value
+PARAMETER_BEGIN: int = LexemeType.PARAMETER_BEGIN.value
+PARAMETER_END: int = LexemeType.PARAMETER_END.value
+
+
+class TokenStream:
+    """Lexemes stored as arrays of type codes and spans of the source text.
+
+    Lexeme content is `text[start:end]` and is only sliced when requested.
+    Contents that are not a single span (tag names interrupted by an escaped
+    symbol or "}") are stored separately.
+    """
+
+    __slots__ = (
+        "contents",
+        "ends",
+        "offset",
+        "positions",
+        "starts",
+        "text",
+        "types",
+    )
+
+    def __init__(self, text: str, offset: int = 0) -> None:
+        self.text: str = text
+        """Text the spans refer to."""
+
+        self.offset: int = offset
+        """Offset of the text in the whole input, added to positions."""
+
+        offset_code: str = "I" if len(text) < 2**32 else "Q"
+
+        self.types: array[int] = array("B")
+        """Lexeme type codes, see `LexemeType`."""
+
+        self.starts: array[int] = array(offset_code)
+        """Start offsets of the lexeme spans."""
+
+        self.ends: array[int] = array(offset_code)
+        """End offsets of the lexeme spans."""
+
+        self.contents: dict[int, str] = {}
+        """Contents of lexemes that are not a single span, by lexeme index."""
+
+        self.positions: array[int] | None = None
+        """Explicit lexeme positions, if they can't be derived from spans."""
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def append(self, type_: int, start: int, end: int) -> None:
+        """Add a lexeme."""
+        self.types.append(type_)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def content(self, index: int) -> str | None:
+        """Get content of the lexeme."""
+        type_: int = self.types[index]
+        if type_ in (PARAMETER_BEGIN, PARAMETER_END):
+            return None
+        if index in self.contents:
+            return self.contents[index]
+        return self.text[self.starts[index] : self.ends[index]]
+
+    def position(self, index: int) -> int:
+        """Get the position of the lexeme the same way as `lexer` does."""
+        if self.positions is not None:
+            return self.positions[index]
+        type_: int = self.types[index]
+        if type_ == TEXT:
+            end: int = self.ends[index]
+            # Text before the final backslash is added at the end of the text.
+            if end == len(self.text) - 1 and self.text[end] == "\\":
+                return self.offset + end + 1
+            return self.offset + end
+        if type_ == TAG:
+            return self.offset + self.starts[index + 1]
+        return self.offset + self.starts[index]
+
+    def lexemes(self) -> tuple[list[Lexeme], list[int]]:
+        """Get lexemes and their positions in the form of `lexer` output."""
+        names: list[str] = [x.name.lower() for x in LexemeType]
+        return (
+            [
+                Lexeme(names[type_], self.content(index))
+                for index, type_ in enumerate(self.types)
+            ],
+            [self.position(index) for index in range(len(self))],
+        )
+
+    @classmethod
+    def from_lexemes(
+        cls, lexemes: list[Lexeme], positions: list[int]
+    ) -> TokenStream:
+        """Store lexemes produced by `lexer`."""
+        codes: dict[str, int] = {x.name.lower(): x.value for x in LexemeType}
+        parts: list[str] = []
+        offsets: list[int] = []
+        offset: int = 0
+        for lexeme in lexemes:
+            offsets.append(offset)
+            if lexeme.content is not None:
+                parts.append(lexeme.content)
+                offset += len(lexeme.content)
+        tokens: TokenStream = cls("".join(parts))
+        for index, lexeme in enumerate(lexemes):
+            length: int = 0 if lexeme.content is None else len(lexeme.content)
+            tokens.append(
+                codes[lexeme.type], offsets[index], offsets[index] + length
+            )
+        tokens.positions = array("Q", positions)
+        return tokens
+
+
+class Lexer:
+    r"""Lexer for formatted preprocessed text that comes in chunks.
+
+    Produces exactly the same lexemes as `lexer`, but instead of walking the
+    text character by character, jumps between special characters (`\`,
+    `{`, `}`, and spaces after tag names) and stores words and tag names as
+    `(start, end)` spans of the text.
+
+    Unfinished words and tag names are kept between chunks, as well as a
+    backslash at the end of a chunk, whose meaning depends on the next
+    character.
+    """
+
+    def __init__(self) -> None:
+        self.offset: int = 0
+        self.in_tag: bool = False
+        self.word_parts: list[str] = []
+        self.tag_prefix: str = ""
+        self.backslash: bool = False
+
+    def feed(self, text: str, *, final: bool = False) -> TokenStream:
+        """Get lexemes of the next chunk.
+
+        :param text: next part of the text
+        :param final: whether this is the last chunk
+        """
+        offset: int = self.offset
+        if self.backslash:
+            text = Constant.TAG_MARKER.value + text
+            offset -= 1
+            self.backslash = False
+        self.offset = offset + len(text)
+
+        tokens: TokenStream = TokenStream(text, offset)
+        add_type = tokens.types.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        contents: dict[int, str] = tokens.contents
+        length: int = len(text)
+
+        search_text = TEXT_BOUNDARY.search
+        search_tag = TAG_BOUNDARY.search
+        tag_marker: str = Constant.TAG_MARKER.value
+        argument_start: str = Constant.ARGUMENT_START.value
+        argument_end: str = Constant.ARGUMENT_END.value
+
+        in_tag: bool = self.in_tag
+        word_start: int = 0
+        # Parts of the current word from the previous chunks.
+        word_parts: list[str] = self.word_parts
+
+        # Tag name is `tag_prefix + text[tag_start:tag_end]`. The prefix is
+        # used when the name is interrupted by an escaped symbol or "}", or
+        # started in the previous chunks.
+        tag_prefix: str = self.tag_prefix
+        tag_start: int = 0
+        tag_end: int = 0
+
+        index: int = 0
+        word_end: int = length
+
+        while index < length:
+            match = (search_tag if in_tag else search_text)(text, index)
+            position: int = length if match is None else match.start()
+
+            if in_tag and position > index:
+                if index == tag_end:
+                    tag_end = position
+                else:
+                    tag_prefix += text[tag_start:tag_end]
+                    tag_start, tag_end = index, position
+
+            if match is None:
+                break
+
+            char: str = text[position]
+            if char == tag_marker:
+                if position == length - 1:
+                    if final:
+                        logger.error("Backslash at the end of string.")
+                    else:
+                        self.backslash = True
+                    word_end = position
+                    break
+                if not in_tag and (position > word_start or word_parts):
+                    if word_parts:
+                        word_parts.append(text[word_start:position])
+                        contents[len(tokens)] = "".join(word_parts)
+                        word_parts = []
+                    add_type(TEXT)
+                    add_start(word_start)
+                    add_end(position)
+                next_char: str = text[position + 1]
+                if not (next_char.isalpha() or next_char.isdigit()):
+                    add_type(SYMBOL)
+                    add_start(position + 1)
+                    add_end(position + 2)
+                    index = word_start = position + 2
+                else:
+                    in_tag = True
+                    tag_prefix = ""
+                    index = tag_start = tag_end = position + 1
+            elif char == argument_start:
+                in_tag = False
+                if tag_prefix or tag_end > tag_start:
+                    if tag_prefix:
+                        contents[len(tokens)] = (
+                            tag_prefix + text[tag_start:tag_end]
+                        )
+                    add_type(TAG)
+                    add_start(tag_start)
+                    add_end(tag_end)
+                add_type(PARAMETER_BEGIN)
+                add_start(position)
+                add_end(position)
+                tag_prefix = ""
+                tag_start = tag_end = 0
+                index = word_start = position + 1
+                word_parts = []
+            elif char == argument_end:
+                if not in_tag and (position > word_start or word_parts):
+                    if word_parts:
+                        word_parts.append(text[word_start:position])
+                        contents[len(tokens)] = "".join(word_parts)
+                        word_parts = []
+                    add_type(TEXT)
+                    add_start(word_start)
+                    add_end(position)
+                add_type(PARAMETER_END)
+                add_start(position)
+                add_end(position)
+                index = word_start = position + 1
             else:
-                index += 1
-                index, res = get_intermediate(lexemes, positions, level, index)
-                tag.parameters.append(res)
-            index += 1
-            continue
-        elif item.type == "parameter_end":
-            level -= 1
-            if level < 0:
-                position = positions[index]
-                logger.error("Lexer error at %d.", position)
-                index += 1
-                sys.exit(1)
-            if tag:
-                result.append(tag)
-            return index, result
-        elif item.type in ("text", "symbol"):
+                # Space after a tag name.
+                in_tag = False
+                index = word_start = position + 1
+
+        if not in_tag and (word_end > word_start or word_parts):
+            if final:
+                if word_parts:
+                    word_parts.append(text[word_start:word_end])
+                    contents[len(tokens)] = "".join(word_parts)
+                    word_parts = []
+                add_type(TEXT)
+                add_start(word_start)
+                add_end(word_end)
+            elif word_end > word_start:
+                word_parts.append(text[word_start:word_end])
+
+        self.in_tag = in_tag
+        self.word_parts = word_parts
+        self.tag_prefix = tag_prefix + text[tag_start:tag_end]
+
+        return tokens
+
+
+def tokenize(text: str) -> TokenStream:
+    """Parse formatted preprocessed text to a stream of lexemes."""
+    return Lexer().feed(text, final=True)
+
+
+def span_lexer(text: str) -> tuple[list[Lexeme], list[int]]:
+    """Parse formatted preprocessed text to a list of lexemes via `tokenize`."""
+    return tokenize(text).lexemes()
+
+
+def tokenize_reference(text: str) -> TokenStream:
+    """Parse formatted preprocessed text to a stream of lexemes with `lexer`."""
+    return TokenStream.from_lexemes(*lexer(text))
+
+
+LEXERS: dict[str, Callable[[str], TokenStream]] = {
+    "reference": tokenize_reference,
+    "span": tokenize,
+}
+"""Lexer engines selectable in `Moire.get_ir`."""
+
+
+class ParseError(ValueError):
+    """Error in the structure of Moire code."""
+
+    def __init__(self, message: str, position: int) -> None:
+        super().__init__(message, position)
+        self.message: str = message
+        self.position: int = position
+        """Offset in the source text."""
+
+    def __str__(self) -> str:
+        return f"{self.message} at {self.position}."
+
+
+PendingTag = tuple[str, list[Any], int]
+"""Tag under construction: name, parameters, and index of its slot."""
+
+
+class IntermediateBuilder:
+    """Builder of intermediate representation from lexemes.
+
+    Open parameters are kept on an explicit stack, so the nesting depth is not
+    limited by the interpreter recursion limit.
+    """
+
+    def __init__(
+        self,
+        errors: list[ParseError] | None = None,
+        checkpoints: list[tuple[int, int]] | None = None,
+    ) -> None:
+        self.errors: list[ParseError] | None = errors
+        """If set, errors are collected here instead of being raised."""
+
+        self.checkpoints: list[tuple[int, int]] | None = checkpoints
+        """If set, checkpoints of top-level tags are collected here.
+
+        Checkpoint is a source offset of the backslash that starts a top-level
+        tag, and the index of the tag in the representation. Lexer and builder
+        states right after such a backslash do not depend on the preceding
+        text, so parsing may be restarted from there.
+        """
+
+        self.source_map: SourceMap | None = None
+        self.last_end: int = -1
+
+        self.root: list[Any] = []
+        self.result: list[Any] = self.root
+
+        # Current tag: its name, collected parameters, and index of the slot
+        # reserved for it in the element list.  The tag is constructed once
+        # all its parameters are known.
+        self.tag: PendingTag | None = None
+
+        # Enclosing element lists, their current tags, and positions of the
+        # opening braces.
+        self.stack: list[tuple[list[Any], PendingTag | None, int]] = []
+
+    def error(self, message: str, position: int) -> None:
+        """Raise or collect a parse error.
+
+        :param message: error description
+        :param position: offset in the text without comments
+        """
+        if self.source_map is not None:
+            position = self.source_map.to_source(position)
+        error: ParseError = ParseError(message, position)
+        if self.errors is None:
+            raise error
+        self.errors.append(error)
+
+    def add_checkpoint(self, tokens: TokenStream, index: int) -> None:
+        """Register a checkpoint for the top-level tag lexeme."""
+        if self.checkpoints is None or index in tokens.contents:
+            return
+
+        # Tag should directly follow its backslash: no other lexemes between.
+        start: int = tokens.offset + tokens.starts[index]
+        previous_end: int = (
+            tokens.offset + tokens.ends[index - 1] if index else self.last_end
+        )
+        if previous_end >= start:
+            return
+
+        backslash: int = start - 1
+        if self.source_map is not None:
+            backslash = self.source_map.to_source(start - 1)
+            if self.source_map.to_source(start) != backslash + 1:
+                return
+
+        self.checkpoints.append((backslash, len(self.result) - 1))
+
+    def feed(
+        self, tokens: TokenStream, source_map: SourceMap | None = None
+    ) -> None:
+        """Add lexemes to the representation.
+
+        :param tokens: lexemes of the text
+        :param source_map: map from lexeme positions back to the source text,
+            used to report errors at their place in the original file
+        """
+        self.source_map = source_map
+        checkpoints: bool = self.checkpoints is not None
+
+        types: array[int] = tokens.types
+        starts: array[int] = tokens.starts
+        ends: array[int] = tokens.ends
+        contents: dict[int, str] = tokens.contents
+        text: str = tokens.text
+        offset: int = tokens.offset
+
+        result: list[Any] = self.result
+        tag: PendingTag | None = self.tag
+        stack: list[tuple[list[Any], PendingTag | None, int]] = self.stack
+        push = stack.append
+        pop = stack.pop
+
+        for index, type_ in enumerate(types):
+            if type_ == PARAMETER_BEGIN:
+                parameter: list[Any] = []
+                if tag:
+                    tag[1].append(parameter)
+                else:
+                    result.append(parameter)
+                push((result, tag, offset + starts[index]))
+                result, tag = parameter, None
+                continue
+
             if tag:
-                result.append(tag)
+                result[tag[2]] = Tag(tag[0], tag[1])
                 tag = None
-            result.append(item.content)
-        index += 1
-    if tag:
-        result.append(tag)
-    return index, result
+
+            if type_ == PARAMETER_END:
+                if stack:
+                    result, tag, _ = pop()
+                else:
+                    self.error("Unmatched `}`", tokens.position(index))
+            elif index in contents:
+                if type_ == TAG:
+                    tag = (contents[index], [], len(result))
+                    result.append(None)
+                else:
+                    result.append(contents[index])
+            elif type_ == TAG:
+                tag = (text[starts[index] : ends[index]], [], len(result))
+                result.append(None)
+                if checkpoints and not stack:
+                    self.result = result
+                    self.add_checkpoint(tokens, index)
+            else:
+                result.append(text[starts[index] : ends[index]])
+
+        self.result, self.tag = result, tag
+        if types:
+            self.last_end = offset + ends[-1]
+
+    def finish(self) -> list[Any]:
+        """Close open parameters and get the representation."""
+        if self.errors is not None:
+            for _, _, position in self.stack:
+                self.error("Unclosed `{`", position)
+
+        self.stack.append((self.result, self.tag, 0))
+        for result, tag, _ in reversed(self.stack):
+            if tag:
+                result[tag[2]] = Tag(tag[0], tag[1])
+
+        self.stack = []
+        self.result, self.tag = self.root, None
+        return self.root
+
+
+def get_intermediate(
+    tokens: TokenStream,
+    source_map: SourceMap | None = None,
+    errors: list[ParseError] | None = None,
+) -> list[Any]:
+    """Get intermediate representation.
+
+    Parameters that are not closed at the end of the text are closed
+    implicitly.
+
+    :param tokens: lexemes of the text
+    :param source_map: map from lexeme positions back to the source text, used
+        to report errors at their place in the original file
+    :param errors: if set, structural errors are collected into this list and
+        parsing continues; otherwise the first unmatched `}` raises
+        `ParseError`
+    """
+    builder: IntermediateBuilder = IntermediateBuilder(errors)
+    builder.feed(tokens, source_map)
+    return builder.finish()
+
+
+def read_chunks(source: Iterable[str]) -> Iterator[str]:
+    """Get text chunks from a file-like object or an iterable of strings."""
+    read: Callable[[int], str] | None = getattr(source, "read", None)
+    if read is None:
+        yield from source
+        return
+    while chunk := read(CHUNK_SIZE):
+        yield chunk
+
+
+def get_intermediate_from_chunks(
+    chunks: Iterable[str], errors: list[ParseError] | None = None
+) -> list[Any]:
+    """Get intermediate representation of text that comes in chunks.
+
+    Comments, lexemes, and the representation are processed chunk by chunk,
+    so the whole text is never kept in memory.
+
+    :param chunks: parts of the source text
+    :param errors: if set, structural errors are collected into this list and
+        parsing continues; otherwise the first unmatched `}` raises
+        `ParseError`
+    """
+    stripper: CommentStripper = CommentStripper()
+    lexer_: Lexer = Lexer()
+    builder: IntermediateBuilder = IntermediateBuilder(errors)
+    for chunk in chunks:
+        builder.feed(lexer_.feed(stripper.feed(chunk)), stripper.source_map)
+    builder.feed(
+        lexer_.feed(stripper.feed("", final=True), final=True),
+        stripper.source_map,
+    )
+    return builder.finish()
+
+
+def get_intermediate_with_checkpoints(
+    text: str, *, partial: bool = False
+) -> tuple[list[Any], list[tuple[int, int]], bool]:
+    """Get intermediate representation and checkpoints of top-level tags.
+
+    :param text: source text
+    :param partial: whether the text is followed by a checkpoint; structural
+        errors are then not raised
+    :return: representation, checkpoints, and whether parsing of the text
+        followed by a checkpoint gives the same result as parsing of the text
+        alone: there are no errors and the text does not end inside a comment,
+        parameter, or escape sequence
+    """
+    stripper: CommentStripper = CommentStripper()
+    lexer_: Lexer = Lexer()
+    errors: list[ParseError] | None = [] if partial else None
+    checkpoints: list[tuple[int, int]] = []
+    builder: IntermediateBuilder = IntermediateBuilder(errors, checkpoints)
+
+    tokens: TokenStream = lexer_.feed(
+        stripper.feed(text, final=True), final=not partial
+    )
+    builder.feed(tokens, stripper.source_map)
+    is_complete: bool = True
+    if partial:
+        is_complete = stripper.adding and not lexer_.backslash
+        if is_complete:
+            builder.feed(lexer_.feed("", final=True), stripper.source_map)
+    ir: list[Any] = builder.finish()
+
+    return ir, checkpoints, is_complete and not errors
+
+
+def get_outline(text: str) -> list[tuple[str, int]] | None:
+    """Get identifiers of top-level headers and labels.
+
+    Only braces, escaped symbols, and starts of tag names are looked at, the
+    same way as `Lexer` and `IntermediateBuilder` treat them, but neither
+    lexemes nor the intermediate representation are built.
+
+    :param text: source text
+    :return: list of tuples (id, level), level is 0 for labels, or `None` if
+        the text should be parsed to get them: some identifier is not plain
+        text, a tag name is interrupted, or a non-ASCII symbol is escaped
+    """
+    stripped, source_map = strip_comments(text)
+    if Constant.ARGUMENT_END.value not in stripped and not OUTLINE_TAG.search(
+        stripped
+    ):
+        return []
+    if (
+        stripped.endswith(Constant.TAG_MARKER.value)
+        or ESCAPE_MARK in stripped
+        or NON_ASCII_ESCAPE.search(stripped)
+    ):
+        return None
+
+    # Escaped symbols are replaced with marks, so that all remaining braces
+    # are parameter bounds and all remaining backslashes start tag names.
+    cleaned: str = ESCAPE.sub(ESCAPE_MARK * 2, stripped)
+
+    ids: list[tuple[str, int]] = []
+    argument_end: str = Constant.ARGUMENT_END.value
+    depth: int = 0
+    last_begin: int = -1
+    last_end: int = -1
+
+    # Current top-level header or label: its level, or -1 if there is none,
+    # and positions of its parameters.
+    level: int = -1
+    parameters: list[int] = []
+
+    for match in BRACE.finditer(cleaned):
+        position: int = match.start()
+
+        if cleaned[position] == argument_end:
+            if not depth:
+                message: str = "Unmatched `}`"
+                raise ParseError(message, source_map.to_source(position))
+            depth -= 1
+            if not depth:
+                last_end = position
+            continue
+
+        if depth:
+            depth += 1
+            last_begin = position
+            continue
+
+        # Name of the tag that gets this parameter starts after the last
+        # backslash since the previous `{`.
+        name_start: int = cleaned.rfind("\\", last_begin + 1, position) + 1
+
+        # Parameter belongs to the current tag if there were no lexemes after
+        # its previous parameter.
+        if (
+            not name_start
+            and level >= 0
+            and cleaned.find(ESCAPE_MARK, last_end + 1, position) < 0
+        ):
+            parameters.append(position + 1)
+        else:
+            if level >= 0 and not add_outline_entry(
+                ids, cleaned, level, parameters
+            ):
+                return None
+            level = -1
+            if name_start and cleaned[name_start] in OUTLINE_NAME_STARTS:
+                name: str | None = get_tag_name(cleaned, name_start)
+                if name is None:
+                    return None
+                level = 0 if name == "label" else HEADER_LEVELS.get(name, -1)
+                parameters = [position + 1]
+
+        depth = 1
+        last_begin = position
+
+    if level >= 0 and not add_outline_entry(ids, cleaned, level, parameters):
+        return None
+
+    return ids
+
+
+def get_tag_name(text: str, start: int) -> str | None:
+    """Get name of the tag followed by parameters.
+
+    :param text: text with escaped symbols replaced with marks
+    :param start: position of the first symbol of the name
+    :return: name or `None` if it is interrupted by an escaped symbol or `}`
+    """
+    match: re.Match[str] | None = TAG_BOUNDARY.search(text, start)
+    end: int = len(text) if match is None else match.start()
+    name: str = text[start:end]
+    if (
+        text[end : end + 1] == Constant.ARGUMENT_END.value
+        or ESCAPE_MARK in name
+    ):
+        return None
+    return name
+
+
+def add_outline_entry(
+    ids: list[tuple[str, int]], text: str, level: int, parameters: list[int]
+) -> bool:
+    """Add identifier of a header or a label to the outline.
+
+    Identifier is the first element of the second parameter of a header and of
+    the first parameter of a label.
+
+    :param ids: outline, see `get_outline`
+    :param text: text with escaped symbols replaced with marks
+    :param level: header level, 0 for labels
+    :param parameters: positions of tag parameters
+    :return: false if the identifier is not plain text
+    """
+    start: int
+    if level:
+        if len(parameters) <= 1:
+            return True
+        start = parameters[1]
+    elif parameters:
+        start = parameters[0]
+    else:
+        return False
+
+    match: re.Match[str] | None = ELEMENT_END.search(text, start)
+    end: int = len(text) if match is None else match.start()
+    if end == start or text[end : end + 1] == Constant.ARGUMENT_START.value:
+        return False
+
+    ids.append((text[start:end], level))
+    return True
+
+
+def build_content_tree(ir: list[Any]) -> Tree:
+    r"""Construct content table from headers of intermediate representation.
+
+    Identifiers of headers, `\<level> {<text>} {<identifier>}`, and labels,
+    `\label {<identifier>}`, are collected into the index of the root.  If an
+    identifier is used several times, its first use is indexed.
+
+    :param ir: intermediate representation
+    :return: root of the content table
+    """
+    index: dict[str, IndexEntry] = {}
+    content_root: Tree = Tree(None, [], Tag("0", ["_", "_"]), index=index)
+    tree: Tree = content_root
+
+    for position, part in enumerate(ir):
+        if not isinstance(part, Tag):
+            continue
+
+        level: int = part.level
+        if not level:
+            if part.id == "label" and part.parameters:
+                index.setdefault(
+                    get_text(part.parameters[0]),
+                    IndexEntry(tree, 0, position),
+                )
+            continue
+
+        while level <= tree.element.level:
+            if tree.parent is None:
+                message: str = f"No parent for {tree}."
+                raise ValueError(message)
+            tree = tree.parent
+
+        element: Tree = Tree(tree, [], part, len(tree.children))
+        tree.children.append(element)
+        tree = element
+
+        if len(part.parameters) > 1:
+            index.setdefault(
+                get_text(part.parameters[1]),
+                IndexEntry(element, level, position),
+            )
+
+    return content_root
+
+
+def get_text(element: Any) -> str:
+    """Get text of the element without tags.
+
+    :param element: string or list of elements
+    """
+    if isinstance(element, str):
+        return element
+    return "".join([x for x in element if isinstance(x, str)])
+
+
+def convert_formats(
+    input_data: str | Iterable[str],
+    converters: Sequence[Moire],
+    *,
+    wrap: bool = True,
+    in_block: bool = False,
+    outputs: Sequence[Writer | None] | None = None,
+) -> list[str]:
+    """Convert Moire code into several formats.
+
+    The code is parsed once, with the first converter, and the intermediate
+    representation and its content table are shared by all converters.
+
+    :param input_data: input text, file-like object, or iterable of text
+        chunks
+    :param converters: converters for each format
+    :param outputs: writers for each format, see `Moire.convert`
+    :return: converted texts, empty for formats with writers
+    """
+    if not converters:
+        return []
+    if outputs is None:
+        outputs = [None] * len(converters)
+    if len(outputs) != len(converters):
+        message: str = (
+            f"{len(outputs)} outputs are given for {len(converters)} "
+            "converters."
+        )
+        raise ValueError(message)
+
+    ir: list[Any] = converters[0].get_ir(input_data)
+    content_root: Tree = build_content_tree(ir)
+
+    return [
+        converter.convert_ir(
+            ir,
+            wrap=wrap,
+            in_block=in_block,
+            output=output,
+            content_root=content_root,
+        )
+        for converter, output in zip(converters, outputs, strict=True)
+    ]
+
+
+def get_intermediate_from_text(
+    text: str | Iterable[str],
+    engine: str = "span",
+    errors: list[ParseError] | None = None,
+) -> list[Any]:
+    """Get intermediate representation of the source text.
+
+    :param text: input text, file-like object, or iterable of text chunks
+    :param engine: lexer engine from `LEXERS`
+    :param errors: if set, structural errors are collected into this list
+        instead of raising `ParseError`
+    """
+    if not isinstance(text, str) and engine == "span":
+        return get_intermediate_from_chunks(read_chunks(text), errors)
+
+    if not isinstance(text, str):
+        text = "".join(read_chunks(text))
+
+    # Remove comments.
+    text, source_map = strip_comments(text)
+
+    # Parse text into lexemes.
+    tokens: TokenStream = LEXERS[engine](text)
+
+    # Get intermediate representation.
+    return get_intermediate(tokens, source_map, errors)
+
+
+Handler = Callable[..., Any]
+"""Tag handler: function that takes the converter and tag arguments."""
+
+
+class Output:
+    """Formatted text built from fragments.
+
+    Fragments are collected in a list and joined once in `build`, so building
+    a large table or list takes linear time.  Output is also a `Writer`, so
+    elements may be streamed into it.
+    """
+
+    __slots__: ClassVar[tuple[str, ...]] = ("fragments",)
+
+    def __init__(self, *fragments: str) -> None:
+        self.fragments: list[str] = list(fragments)
+
+    def add(self, *fragments: str) -> None:
+        """Add fragments to the end of the text."""
+        self.fragments.extend(fragments)
+
+    def write(self, text: str, /) -> int:
+        """Add a fragment to the end of the text."""
+        self.fragments.append(text)
+        return len(text)
+
+    def build(self) -> str:
+        """Get the text."""
+        return "".join(self.fragments)
+
+
+class Writer(Protocol):
+    """Output for streamed conversion: file, `sys.stdout`, socket file."""
+
+    def write(self, text: str, /) -> object:
+        """Write a fragment of the output."""
+
+
+def drop_converter(function: Callable[..., Any]) -> Handler:
+    """Make a tag handler from a function that does not take the converter."""
+
+    def handler(_: Moire, *arguments: Any) -> Any:
+        return function(*arguments)
+
+    return handler
+
+
+@dataclass
+class Macro:
+    """Definition of a tag compiled into a template."""
+
+    pattern: Any
+    """Source pattern, list of elements."""
+
+    parts: list[Any]
+    """Parts of the template: rendered text, index of an argument, or an
+    element rendered on each use."""
+
+
+class MacroArguments:
+    r"""Arguments of a tag defined with `\define`.
+
+    Argument is rendered when it is referenced for the first time.  While an
+    argument is rendered, `\arg` refers to the preceding arguments of the same
+    tag.
+    """
+
+    __slots__: ClassVar[tuple[str, ...]] = (
+        "converter",
+        "limit",
+        "parameters",
+        "values",
+    )
+
+    def __init__(
+        self,
+        converter: Moire,
+        parameters: Sequence[Any],
+        values: list[str | None] | None = None,
+        limit: int | None = None,
+    ) -> None:
+        """Create arguments.
+
+        :param converter: converter that renders the arguments
+        :param parameters: tag parameters
+        :param values: rendered arguments shared with the other views
+        :param limit: number of the first arguments available
+        """
+        self.converter: Moire = converter
+        self.parameters: Sequence[Any] = parameters
+        self.values: list[str | None] = (
+            [None] * len(parameters) if values is None else values
+        )
+        self.limit: int = len(parameters) if limit is None else limit
+
+    def __len__(self) -> int:
+        return self.limit
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += self.limit
+        if not 0 <= index < self.limit:
+            message: str = "list index out of range"
+            raise IndexError(message)
+
+        value: str | None = self.values[index]
+        if value is None:
+            converter: Moire = self.converter
+            outer_arguments: list[str] | MacroArguments = (
+                converter.definition_arguments
+            )
+            converter.definition_arguments = MacroArguments(
+                converter, self.parameters, self.values, index
+            )
+            try:
+                value = self.values[index] = converter.parse(
+                    self.parameters[index]
+                )
+            finally:
+                converter.definition_arguments = outer_arguments
+        return value
 
 
 @dataclass
@@ -326,13 +1732,29 @@ class Moire:
     block_tags: ClassVar[set[str]] = set()
     """List of block tags."""
 
+    stateful_tags: ClassVar[set[str]] = {"arg", "body", "define", "header"}
+    """Tags whose formatting depends on or changes the converter state.  They
+    and tags that contain them are never reused by the render cache.  Macros,
+    see `define`, are always stateful."""
+
     id_: ClassVar[str] = "moire"
     """Format identifier."""
 
+    version: ClassVar[int] = 1
+    """Version of the converter.  It should be increased when the output for
+    the same code changes, so that incremental builds convert files again."""
+
     extensions: ClassVar[list[str]] = []
     """List of typical file extensions."""
 
     escape_symbols: ClassVar[dict[str, str]] = {}
+    """Mapping from special symbols to their escaped forms.  Symbols are
+    replaced in order, so replacement of a symbol may contain the preceding
+    symbols."""
+
+    compiled_escape: ClassVar[tuple[dict[str, str], Callable[[str], str]]]
+    """Copy of escape symbols of the class and the function that replaces
+    them."""
 
     file_name: str | None = None
 
@@ -345,7 +1767,88 @@ class Moire:
     definitions: dict[str, str] = field(default_factory=dict)
     """Mapping from tag names to patterns."""
 
-    definition_arguments: list[str] = field(default_factory=list)
+    definition_arguments: list[str] | MacroArguments = field(
+        default_factory=list
+    )
+    """Arguments of the macro being rendered, referenced by `\\arg`."""
+
+    macros: dict[str, Macro] = field(default_factory=dict)
+    """Compiled definitions, see `get_macro`."""
+
+    render_cache_size: int = 0
+    """Maximum number of formatted tags kept for reuse.  If set, tags equal to
+    already formatted ones are not formatted again during one conversion.
+    Disabled by default."""
+
+    render_cache: OrderedDict[Tag, str] = field(default_factory=OrderedDict)
+    """Formatted tags from the least to the most recently used."""
+
+    stateful_count: int = 0
+    """Number of formatted stateful tags, see `stateful_tags`."""
+
+    ir_cache: IRCache | None = None
+    """Cache of intermediate representations of input texts."""
+
+    header_index: dict[str, IndexEntry] = field(default_factory=dict)
+    """Headers and labels of the document being converted by their
+    identifiers, see `build_content_tree`."""
+
+    handler_tables: ClassVar[dict[str, dict[str, Handler]]]
+    """Tag handlers of the class for each parsing mode, see `get_handlers`."""
+
+    @classmethod
+    def get_handlers(cls, mode: str = "") -> dict[str, Handler]:
+        """Get tag handlers of the class for the parsing mode.
+
+        Handler of tag `<key>` is method `<mode><key>` or, if there is no such
+        method, `<mode><key>__`, which is used for tags named as Python
+        keywords.  The table is built once per class.
+
+        :param mode: method name prefix: empty for rendering or `pre_` for the
+            preliminary pass
+        :return: mapping from tag names to functions that take the converter
+            and tag arguments
+        """
+        tables: dict[str, dict[str, Handler]] | None = cls.__dict__.get(
+            "handler_tables"
+        )
+        if tables is None:
+            tables = cls.handler_tables = {}
+        if mode in tables:
+            return tables[mode]
+
+        handlers: dict[str, Handler] = {}
+        aliases: dict[str, Handler] = {}
+
+        for name in dir(cls):
+            key: str = name[len(mode) :]
+            if name.startswith(mode) and key[:1].isalnum():
+                # Attribute without calling descriptors, as
+                # `inspect.getattr_static` does.
+                attribute: Any = next(
+                    (
+                        base.__dict__[name]
+                        for base in cls.__mro__
+                        if name in base.__dict__
+                    ),
+                    None,
+                )
+                handler: Handler
+                if isinstance(attribute, staticmethod | classmethod):
+                    handler = drop_converter(getattr(cls, name))
+                elif isinstance(attribute, FunctionType):
+                    handler = attribute
+                else:
+                    continue
+                handlers[key] = handler
+                if key.endswith("__"):
+                    aliases[key.removesuffix("__")] = handler
+
+        for key, handler in aliases.items():
+            handlers.setdefault(key, handler)
+
+        tables[mode] = handlers
+        return handlers
 
     def init(self) -> None:
         """Do some preliminary actions."""
@@ -356,11 +1859,22 @@ class Moire:
     def escape(self, text: str) -> str:
         """Escape special characters.
 
-        This method may be overridden if escaping is more complex.
+        Symbols from `escape_symbols` are replaced in order, see
+        `compile_escape`.  This method may be overridden if escaping is more
+        complex.
         """
-        for key, value in self.escape_symbols.items():
-            text = text.replace(key, value)
-        return text
+        compiled: tuple[dict[str, str], Callable[[str], str]] | None = type(
+            self
+        ).__dict__.get("compiled_escape")
+        # Symbols are compared with the copy, so that changes of the mapping
+        # in place are not ignored.
+        if compiled is None or compiled[0] != self.escape_symbols:
+            compiled = (
+                dict(self.escape_symbols),
+                compile_escape(self.escape_symbols),
+            )
+            type(self).compiled_escape = compiled
+        return compiled[1](text)
 
     def block(self, arg: list[Any]) -> str:
         """Block element."""
@@ -373,62 +1887,118 @@ class Moire:
     def get_ids(self, content: str) -> list[tuple[str, int]]:
         """Get all header identifiers.
 
+        Only the outline of the content is scanned, see `get_outline`, and the
+        result is stored in `ir_cache`, if it is set.
+
         :param content: input content in the Moire format
         :return: list of tuples (id, level), level is 0 for labels
         """
-        ids: list[tuple[str, int]] = []
-        intermediate_representation = self.get_ir(content)
-        for element in intermediate_representation:
-            if isinstance(element, Tag):
-                if element.is_header() and len(element.parameters) > 1:
-                    ids.append((element.parameters[1][0], int(element.id)))
-                if element.id == "label":
-                    ids.append((element.parameters[0][0], 0))
+        ids: list[tuple[str, int]] | None = None
+        if self.ir_cache:
+            ids = self.ir_cache.get_outline(content)
+            if ids is not None:
+                return ids
+
+        ids = get_outline(content)
+        if ids is None:
+            ids = []
+            for element in self.get_ir(content):
+                if isinstance(element, Tag):
+                    if element.is_header() and len(element.parameters) > 1:
+                        ids.append((element.parameters[1][0], element.level))
+                    if element.id == "label":
+                        ids.append((element.parameters[0][0], 0))
+
+        if self.ir_cache:
+            self.ir_cache.put_outline(content, ids)
         return ids
 
     def convert(
-        self, input_data: str, *, wrap: bool = True, in_block: bool = False
+        self,
+        input_data: str | Iterable[str],
+        *,
+        wrap: bool = True,
+        in_block: bool = False,
+        output: Writer | None = None,
     ) -> str:
-        """Convert Moire code into selected format."""
+        """Convert Moire code into selected format.
 
-        ir: list[Any] = self.get_ir(input_data)
+        :param input_data: input text, file-like object, or iterable of text
+            chunks
+        :param output: if set, the result is written here fragment by
+            fragment, as it is produced, and an empty string is returned
+        """
+        return self.convert_ir(
+            self.get_ir(input_data),
+            wrap=wrap,
+            in_block=in_block,
+            output=output,
+        )
 
-        # Construct content table
+    def convert_ir(
+        self,
+        ir: list[Any],
+        *,
+        wrap: bool = True,
+        in_block: bool = False,
+        output: Writer | None = None,
+        content_root: Tree | None = None,
+    ) -> str:
+        """Convert intermediate representation into selected format.
 
-        tree: Tree = Tree(None, [], Tag("0", ["_", "_"]))
-        content_root: Tree = tree
-        for part in ir:
-            if not isinstance(part, Tag) or part.id not in "123456":
-                continue
-            element: Tree = Tree(tree, [], part)
-            if int(part.id) > int(tree.element.id):
-                tree.children.append(element)
-                element.number = len(tree.children) - 1
-                tree = tree.children[-1]
-            else:
-                while int(part.id) <= int(tree.element.id):
-                    if tree.parent is None:
-                        message: str = f"No parent for {tree}."
-                        raise ValueError(message)
-                    tree = tree.parent
-                tree.children.append(element)
-                element.number = len(tree.children) - 1
-                element.parent = tree
-                tree = tree.children[-1]
+        :param ir: intermediate representation
+        :param output: if set, the result is written here fragment by
+            fragment, as it is produced, and an empty string is returned
+        :param content_root: content table of the representation, if it is
+            already built, see `build_content_tree`
+        """
+        if content_root is None:
+            content_root = build_content_tree(ir)
         self.status["tree"] = content_root
+        self.header_index = content_root.index or {}
 
         # Wrap whole text with "body" tag
         wrapped_ir: list[Any] | Tag = ir
         if wrap:
             wrapped_ir = Tag("body", [ir, content_root])
 
+        self.render_cache.clear()
         self.init()
-        self.parse(wrapped_ir, mode="pre_")
-        result: str = self.parse(wrapped_ir, in_block=in_block)
+        self.prepare(wrapped_ir)
+        result: str = ""
+        if output is None:
+            result = self.parse(wrapped_ir, in_block=in_block)
+        else:
+            self.stream(wrapped_ir, output, in_block=in_block)
         self.finish()
 
         return result
 
+    def prepare(self, element: list[Any] | Tag) -> None:
+        """Run the preliminary pass with `pre_` tag handlers.
+
+        Tags without `pre_` handlers are skipped together with their
+        parameters, so only tags that have handlers and are not inside other
+        tags are visited, including tags in brace groups.  The pass is skipped
+        if the class has no `pre_` handlers at all.
+
+        :param element: tag or list of elements
+        """
+        handlers: dict[str, Handler] = self.get_handlers("pre_")
+        if not handlers:
+            return
+
+        stack: list[Any] = [element]
+        while stack:
+            item: Any = stack.pop()
+            if isinstance(item, list):
+                stack.extend(reversed(item))
+            elif (
+                isinstance(item, Tag)
+                and ("header" if item.level else item.id) in handlers
+            ):
+                self.parse(item, mode="pre_")
+
     def parse(
         self,
         text: Any,
@@ -454,51 +2024,18 @@ class Moire:
             return self.escape(trim_inside(text))
 
         if isinstance(text, Tag):
-            key: str = "header" if (text.id in "123456") else text.id
+            key: str = "header" if text.level else text.id
 
-            if key == "arg":
-                return self.definition_arguments[
-                    int(self.clear(text.parameters[0])) - 1
-                ]
+            if (
+                key == "arg"
+                or key in self.definitions
+                or key in self.stateful_tags
+            ):
+                self.stateful_count += 1
+            elif self.render_cache_size and not mode and not spec:
+                return self.parse_memoized(text, key)
 
-            if key in self.definitions:
-                pattern: str = self.definitions[key]
-
-                old_value = self.definition_arguments
-                self.definition_arguments = []
-                for arg in text.parameters:
-                    self.definition_arguments.append(self.parse(arg))
-                result: str = self.parse(pattern)
-                self.definition_arguments = old_value
-                return result
-
-            method: Callable | None = None
-            with contextlib.suppress(AttributeError):
-                method = getattr(self, mode + key)
-            if method is None:
-                with contextlib.suppress(AttributeError):
-                    method = getattr(self, mode + key + "__")
-
-            parsed: str
-
-            if method is not None:
-                arg = Argument(text.parameters, spec)
-                if key == "header":
-                    parsed = method(arg, int(text.id))
-                    return parsed
-                parsed = method(arg)
-                return parsed
-
-            if mode == "":
-                if "missing_tags" not in self.status:
-                    self.status["missing_tags"] = set()
-                self.status["missing_tags"].add(key)
-                raise ValueError(
-                    f"Unknown tag `{mode}{key}`"
-                    + (f" in `{self.file_name}`" if self.file_name else "")
-                    + "."
-                )
-            return ""
+            return self.parse_tag(text, key, mode=mode, spec=spec)
 
         if isinstance(text, list):
             builder = StringIO()
@@ -537,6 +2074,140 @@ class Moire:
         message: str = f"Part is of type {type(text)}"
         raise ValueError(message)
 
+    def parse_tag(
+        self,
+        tag: Tag,
+        key: str,
+        *,
+        mode: str = "",
+        spec: dict[str, Any] | None = None,
+    ) -> str:
+        """Format tag with its handler.
+
+        :param tag: tag to format
+        :param key: handler name: tag name or `header`
+        :param mode: handler name prefix
+        :param spec: tag specification, passed to the handler
+        """
+        if key == "arg":
+            return self.definition_arguments[
+                int(self.clear(tag.parameters[0])) - 1
+            ]
+
+        if key in self.definitions:
+            return self.expand(self.get_macro(key), tag.parameters)
+
+        handler: Handler | None = self.get_handlers(mode).get(key)
+
+        parsed: str
+
+        if handler is not None:
+            arg = Argument(tag.parameters, {} if spec is None else spec)
+            if key == "header":
+                parsed = handler(self, arg, tag.level)
+                return parsed
+            parsed = handler(self, arg)
+            return parsed
+
+        if mode == "":
+            if "missing_tags" not in self.status:
+                self.status["missing_tags"] = set()
+            self.status["missing_tags"].add(key)
+            raise ValueError(
+                f"Unknown tag `{mode}{key}`"
+                + (f" in `{self.file_name}`" if self.file_name else "")
+                + "."
+            )
+        return ""
+
+    def parse_memoized(self, tag: Tag, key: str) -> str:
+        """Format tag or reuse the result for an equal tag.
+
+        Result is stored only if no stateful tags were formatted on the way,
+        see `stateful_tags`.
+
+        :param tag: tag to format
+        :param key: handler name: tag name or `header`
+        """
+        cache: OrderedDict[Tag, str] = self.render_cache
+        try:
+            result: str | None = cache.get(tag)
+        except TypeError:
+            # Tag contains unhashable elements.
+            return self.parse_tag(tag, key)
+
+        if result is not None:
+            cache.move_to_end(tag)
+            return result
+
+        stateful_count: int = self.stateful_count
+        result = self.parse_tag(tag, key)
+        if self.stateful_count == stateful_count:
+            cache[tag] = result
+            if len(cache) > self.render_cache_size:
+                cache.popitem(last=False)
+        return result
+
+    def stream(
+        self,
+        text: Any,
+        output: Writer,
+        *,
+        in_block: bool = False,
+        spec: dict[str, Any] | None = None,
+    ) -> None:
+        """Write formatted element to the output.
+
+        Tags are written by `stream_<tag>` handlers, that take the output as
+        the last argument.  Tags without such handlers are formatted by the
+        usual handlers, see `parse`, and written at once.
+
+        :param text: plain text, tag, or list of elements
+        :param output: writer for fragments of the formatted text
+        :param in_block: whether the element is a block
+        :param spec: element specification, passed to the handlers
+        """
+        if spec is None:
+            spec = {}
+
+        if not text:
+            return
+
+        if isinstance(text, Tag):
+            key: str = "header" if text.level else text.id
+            handler: Handler | None = None
+            if key != "arg" and key not in self.definitions:
+                handler = self.get_handlers("stream_").get(key)
+            if handler is None:
+                output.write(self.parse(text, in_block=in_block, spec=spec))
+            elif key == "header":
+                handler(
+                    self, Argument(text.parameters, spec), text.level, output
+                )
+            else:
+                handler(self, Argument(text.parameters, spec), output)
+            return
+
+        if not isinstance(text, list):
+            output.write(self.parse(text, in_block=in_block, spec=spec))
+            return
+
+        inner_block: list[Any] = []
+        for item in text:
+            if not in_block:
+                self.stream(item, output, spec=spec)
+            elif isinstance(item, Tag) and item.id in self.block_tags:
+                if inner_block:
+                    for paragraph in self.get_paragraphs(inner_block):
+                        self.stream(paragraph, output)
+                    inner_block = []
+                self.stream(item, output, in_block=in_block, spec=spec)
+            else:
+                inner_block.append(item)
+        if inner_block:
+            for paragraph in self.get_paragraphs(inner_block):
+                self.stream(paragraph, output)
+
     def clear(self, text: str, *, escape: bool = True) -> str:
         """Get flattened element content."""
 
@@ -550,24 +2221,43 @@ class Moire:
             return self.escape(text)
         return text
 
-    def get_ir(self, text: str, offset: int = 0, prefix: str = "") -> list[Any]:
-        """Get intermediate representation."""
-
-        # Remove comments.
-        text = preprocess_comments(text)
+    def get_ir(
+        self,
+        text: str | Iterable[str],
+        offset: int = 0,
+        prefix: str = "",
+        *,
+        engine: str = "span",
+        errors: list[ParseError] | None = None,
+    ) -> list[Any]:
+        """Get intermediate representation.
+
+        :param text: input text, file-like object, or iterable of text chunks
+        :param engine: lexer engine from `LEXERS`: `span` (default) or
+            `reference`, the original character-by-character lexer
+        :param errors: if set, structural errors are collected into this list
+            instead of raising `ParseError`; `ir_cache` is not used then
+        """
+        if engine not in LEXERS:
+            message: str = f"Unknown lexer engine `{engine}`."
+            raise ValueError(message)
 
-        # Parse text into lexemes.
-        lexemes, positions = lexer(text)
+        raw_ir: list[Any] | None
 
-        # Get intermediate representation.
-        _, raw_ir = get_intermediate(lexemes, positions, 0)
+        if isinstance(text, str) and errors is None and self.ir_cache:
+            raw_ir = self.ir_cache.get(text)
+            if raw_ir is None:
+                raw_ir = get_intermediate_from_text(text, engine)
+                self.ir_cache.put(text, raw_ir)
+        else:
+            raw_ir = get_intermediate_from_text(text, engine, errors)
 
         resulted_ir: list[Any] = []
 
         for item in raw_ir:
             if isinstance(item, Tag):
                 if item.is_header() and (offset or prefix):
-                    new_item = Tag(str(int(item.id) + offset), item.parameters)
+                    new_item = Tag(str(item.level + offset), item.parameters)
                     resulted_ir.append(new_item)
                 else:
                     resulted_ir.append(item)
@@ -576,59 +2266,174 @@ class Moire:
 
         return resulted_ir
 
+    def get_state(self, text: str) -> ParseState:
+        """Parse text so that it can be updated after edits."""
+        ir, checkpoints, _ = get_intermediate_with_checkpoints(text)
+        return ParseState(text, ir, Checkpoints(checkpoints))
+
+    def update_state(
+        self, state: ParseState, offset: int, removed: int, inserted: str
+    ) -> ParseState:
+        """Update parsed text after an edit.
+
+        Only the part of the text between the nearest top-level tags around
+        the edit is parsed again, the rest of the representation, including
+        `Tag` objects, is reused.  The state is updated in place, so that the
+        cost of the edit does not depend on the size of the representation.
+
+        :param state: state of the text before the edit
+        :param offset: offset of the edit in the text
+        :param removed: number of removed characters
+        :param inserted: inserted text
+        :return: the updated state
+        """
+        if offset < 0 or removed < 0 or offset + removed > len(state.text):
+            message: str = f"Edit is out of the text: {offset}, {removed}."
+            raise ValueError(message)
+
+        text: str = (
+            state.text[:offset] + inserted + state.text[offset + removed :]
+        )
+        shift: int = len(inserted) - removed
+        checkpoints: Checkpoints = state.checkpoints
+
+        # The last checkpoint with unchanged backslash and the next character.
+        first: int = checkpoints.bisect_right(offset - 2) - 1
+        start, start_index = checkpoints[first] if first >= 0 else (0, 0)
+
+        # The next checkpoint after the edit, increasing the step until the
+        # text between checkpoints may be parsed separately.
+        last: int = checkpoints.bisect_left(offset + removed)
+        step: int = 1
+        while last < len(checkpoints):
+            end, end_index = checkpoints[last]
+            ir, new_checkpoints, is_complete = (
+                get_intermediate_with_checkpoints(
+                    text[start : end + shift], partial=True
+                )
+            )
+            if is_complete:
+                break
+            last += step
+            step *= 2
+        else:
+            end, end_index = len(state.text), len(state.ir)
+            ir, new_checkpoints, _ = get_intermediate_with_checkpoints(
+                text[start:]
+            )
+
+        index_shift: int = start_index + len(ir) - end_index
+
+        state.text = text
+        state.ir[start_index:end_index] = ir
+        state.checkpoints = checkpoints.replace(
+            max(first, 0),
+            last,
+            [(x + start, y + start_index) for x, y in new_checkpoints],
+            shift,
+            index_shift,
+        )
+        return state
+
     def process_inner_block(self, inner_block: list[Any]) -> str:
         """Wrap parts of inner block element with text tag."""
+        return "".join(
+            str(self.parse(paragraph))
+            for paragraph in self.get_paragraphs(inner_block)
+        )
+
+    @staticmethod
+    def get_paragraphs(inner_block: list[Any]) -> list[Tag | list[Any]]:
+        """Split inner block element into paragraphs.
+
+        Text at the ends of paragraphs is stripped, paragraphs that start or
+        end with text are wrapped with text tag.
 
+        :param inner_block: elements between block tags
+        """
         if len(inner_block) == 1 and inner_block[0] == "":
-            return ""
+            return []
 
-        paragraphs: list[list[str]] = []
-        paragraph: list[str] = []
-
-        for item in inner_block:
-            if isinstance(item, str):
-                previous: int = 0
-                delimiter: int = item.find(Constant.PARAGRAPH_DELIMITER.value)
-                while delimiter != -1:
-                    content = item[previous:delimiter]
-                    if content != "" or previous == 0:
-                        paragraph.append(content)
-                        paragraphs.append(paragraph)
-                        paragraph = []
-                    previous = delimiter + len(
-                        Constant.PARAGRAPH_DELIMITER.value
-                    )
-                    delimiter = item.find(
-                        Constant.PARAGRAPH_DELIMITER.value, delimiter + 1
-                    )
-                paragraph.append(item[previous:])
-            else:
-                paragraph.append(item)
+        result: list[Tag | list[Any]] = []
 
-        paragraphs.append(paragraph)
+        for paragraph in split_paragraphs(inner_block):
+            start: int = 0
+            end: int = len(paragraph)
 
-        result: str = ""
-        for paragraph in paragraphs:
-            if isinstance(paragraph[0], str):
+            if end and isinstance(paragraph[0], str):
                 paragraph[0] = paragraph[0].lstrip()
-                if paragraph[0] == "":
-                    paragraph.pop(0)
-            if len(paragraph) == 0:
+                if not paragraph[0]:
+                    start = 1
+            if start == end:
                 continue
 
             if isinstance(paragraph[-1], str):
                 paragraph[-1] = paragraph[-1].rstrip()
-                if paragraph[-1] == "":
-                    paragraph.pop(-1)
-            if len(paragraph) == 0:
+                if not paragraph[-1]:
+                    end -= 1
+            if start == end:
                 continue
 
-            if isinstance(paragraph[0], str) or isinstance(paragraph[-1], str):
-                result += str(self.parse(Tag("text", [paragraph])))
+            elements: list[Any] = (
+                paragraph[start:end]
+                if start or end < len(paragraph)
+                else paragraph
+            )
+            if isinstance(elements[0], str) or isinstance(elements[-1], str):
+                result.append(Tag("text", [elements]))
             else:
-                result += str(self.parse(paragraph))
+                result.append(elements)
+
         return result
 
+    def get_macro(self, key: str) -> Macro:
+        """Get compiled definition of the tag.
+
+        Definition is compiled on first use and compiled again only if its
+        pattern is replaced.
+
+        :param key: tag name from `definitions`
+        """
+        pattern: Any = self.definitions[key]
+        macro: Macro | None = self.macros.get(key)
+        if macro is not None and macro.pattern is pattern:
+            return macro
+
+        parts: list[Any] = []
+        for element in pattern if isinstance(pattern, list) else [pattern]:
+            if isinstance(element, str):
+                parts.append(self.parse(element))
+                continue
+            if isinstance(element, Tag) and element.id == "arg":
+                with contextlib.suppress(ValueError, IndexError, TypeError):
+                    parts.append(int(self.clear(element.parameters[0])) - 1)
+                    continue
+            parts.append(element)
+
+        macro = self.macros[key] = Macro(pattern, parts)
+        return macro
+
+    def expand(self, macro: Macro, parameters: Sequence[Any]) -> str:
+        """Render compiled definition with tag parameters as arguments.
+
+        :param macro: compiled definition
+        :param parameters: tag parameters
+        """
+        arguments: MacroArguments = MacroArguments(self, parameters)
+        outer_arguments: list[str] | MacroArguments = self.definition_arguments
+        self.definition_arguments = arguments
+        try:
+            return "".join(
+                part
+                if isinstance(part, str)
+                else arguments[part]
+                if isinstance(part, int)
+                else self.parse(part)
+                for part in macro.parts
+            )
+        finally:
+            self.definition_arguments = outer_arguments
+
     def define(self, arg: list[str]) -> str:
         r"""Define pattern for a tag.
 
@@ -642,6 +2447,9 @@ class Moire:
         tag_name: str = self.clear(arg[0])
         pattern: str = arg[1]
         self.definitions[tag_name] = pattern
+        self.macros.pop(tag_name, None)
+        # Formatted tags may contain the tag with the previous meaning.
+        self.render_cache.clear()
 
         return ""
 
@@ -0,0 +1,398 @@
+"""Conversion server.
+
+Long-running process that converts Moire code on requests, so that clients do
+not pay for interpreter startup and imports on every conversion.  The server
+speaks minimal HTTP/1.1 over localhost TCP or over a Unix socket:
+
+- `POST /convert` with a JSON object: `format` (converter identifier, see
+  `Moire.id_`), either `text` (Moire code) or `path` (Moire file), and
+  optional `wrap` (boolean, true by default).  The response body is the
+  converted text.
+- `GET /stats`: JSON object with request counters and latencies.
+
+Conversions run in a pool of processes, the number of simultaneous
+conversions is limited, other requests wait.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from http import HTTPStatus
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from moire.moire import ParseError
+
+if TYPE_CHECKING:
+    from moire.moire import Moire
+
+__author__: str = "Sergey Vartanov"
+__email__: str = "me@enzet.ru"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8000
+MAX_BODY_SIZE: int = 1 << 26
+"""Maximum size of the request body in bytes."""
+
+
+class RequestError(Exception):
+    """Request that cannot be processed."""
+
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status: HTTPStatus = status
+
+
+@dataclass
+class Request:
+    """HTTP request."""
+
+    method: str
+    path: str
+    headers: dict[str, str]
+    """Headers with lowercase names."""
+
+    body: bytes = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        """Check if the connection should be kept open after the response."""
+        return self.headers.get("connection", "").lower() != "close"
+
+
+@dataclass
+class Response:
+    """HTTP response."""
+
+    status: HTTPStatus
+    body: bytes
+    content_type: str = "text/plain; charset=utf-8"
+
+    @classmethod
+    def from_json(cls, status: HTTPStatus, data: Any) -> Response:
+        """Create response with JSON body."""
+        return cls(status, json.dumps(data).encode("utf-8"), "application/json")
+
+    def to_bytes(self, *, keep_alive: bool) -> bytes:
+        """Get status line, headers, and body."""
+        head: str = (
+            f"HTTP/1.1 {self.status.value} {self.status.phrase}\r\n"
+            f"Content-Type: {self.content_type}\r\n"
+            f"Content-Length: {len(self.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        return head.encode("ascii") + self.body
+
+
+@dataclass
+class Statistics:
+    """Counters of conversion requests."""
+
+    requests: int = 0
+    """Number of finished conversion requests."""
+
+    failed: int = 0
+    """Number of conversion requests that failed."""
+
+    active: int = 0
+    """Number of conversion requests being processed or waiting."""
+
+    input_size: int = 0
+    """Total size of converted Moire code in bytes."""
+
+    output_size: int = 0
+    """Total size of produced output in bytes."""
+
+    seconds: float = 0.0
+    """Total latency of conversion requests."""
+
+    max_seconds: float = 0.0
+    """Maximum latency of a conversion request."""
+
+    start: float = field(default_factory=time.monotonic)
+    """Time of the server start."""
+
+    def add(self, seconds: float, *, failed: bool) -> None:
+        """Account finished conversion request."""
+        self.requests += 1
+        self.failed += failed
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_json(self) -> dict[str, Any]:
+        """Get counters, mean latency, and throughput."""
+        uptime: float = time.monotonic() - self.start
+        return {
+            "requests": self.requests,
+            "failed": self.failed,
+            "active": self.active,
+            "input_size": self.input_size,
+            "output_size": self.output_size,
+            "mean_latency": self.seconds / max(self.requests, 1),
+            "max_latency": self.max_seconds,
+            "uptime": uptime,
+            "requests_per_second": self.requests / max(uptime, 1e-9),
+        }
+
+
+def convert_code(
+    class_: type[Moire], text: str | None, path: str | None, *, wrap: bool
+) -> str:
+    """Convert Moire code in a worker process.
+
+    :param class_: converter
+    :param text: Moire code
+    :param path: Moire file, used if there is no code
+    :param wrap: wrap output as a complete document
+    """
+    converter: Moire = class_()
+    if text is None:
+        if path is None:
+            message: str = "No Moire code or file."
+            raise ValueError(message)
+        converter.file_name = path
+        text = Path(path).read_text(encoding="utf-8")
+    return converter.convert(text, wrap=wrap)
+
+
+class Server:
+    """Conversion server."""
+
+    def __init__(
+        self,
+        classes: dict[str, type[Moire]],
+        *,
+        jobs: int | None = None,
+        limit: int | None = None,
+    ) -> None:
+        """Create server.
+
+        :param classes: converters by format identifiers
+        :param jobs: number of worker processes, the number of processors by
+            default
+        :param limit: maximum number of simultaneous conversions, the number
+            of workers by default
+        """
+        self.classes: dict[str, type[Moire]] = classes
+        self.jobs: int = jobs or os.cpu_count() or 1
+        self.executor: ProcessPoolExecutor = ProcessPoolExecutor(self.jobs)
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(
+            limit or self.jobs
+        )
+        self.statistics: Statistics = Statistics()
+
+    async def start(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        socket_path: str | None = None,
+    ) -> asyncio.Server:
+        """Start accepting connections.
+
+        :param host: host for TCP connections
+        :param port: port for TCP connections, 0 for any free port
+        :param socket_path: if set, Unix socket is used instead of TCP
+        """
+        # Workers are started before any connection is accepted, so that they
+        # do not inherit sockets of connections and keep them open.
+        await asyncio.get_running_loop().run_in_executor(self.executor, int)
+
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle, socket_path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        socket_path: str | None = None,
+    ) -> None:
+        """Accept connections until cancelled.
+
+        :param host: host for TCP connections
+        :param port: port for TCP connections
+        :param socket_path: if set, Unix socket is used instead of TCP
+        """
+        server: asyncio.Server = await self.start(host, port, socket_path)
+        addresses: str = ", ".join(
+            str(socket.getsockname()) for socket in server.sockets
+        )
+        logger.info("Serving on %s with %d workers.", addresses, self.jobs)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop worker processes."""
+        self.executor.shutdown(cancel_futures=True)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Process requests of one connection."""
+        try:
+            while True:
+                try:
+                    request: Request | None = await read_request(reader)
+                except RequestError as error:
+                    writer.write(
+                        Response.from_json(
+                            error.status, {"error": str(error)}
+                        ).to_bytes(keep_alive=False)
+                    )
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                response: Response = await self.respond(request)
+                writer.write(response.to_bytes(keep_alive=request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def respond(self, request: Request) -> Response:
+        """Get response for the request."""
+        routes: dict[str, str] = {"/convert": "POST", "/stats": "GET"}
+        if request.path not in routes:
+            return Response.from_json(
+                HTTPStatus.NOT_FOUND, {"error": "Unknown path."}
+            )
+        if request.method != routes[request.path]:
+            return Response.from_json(
+                HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Wrong method."}
+            )
+        if request.path == "/stats":
+            return Response.from_json(HTTPStatus.OK, self.statistics.to_json())
+
+        start: float = time.perf_counter()
+        self.statistics.active += 1
+        try:
+            response: Response = await self.convert(request.body)
+        finally:
+            self.statistics.active -= 1
+        self.statistics.add(
+            time.perf_counter() - start, failed=response.status != HTTPStatus.OK
+        )
+        return response
+
+    async def convert(self, body: bytes) -> Response:
+        """Convert Moire code of the conversion request.
+
+        :param body: JSON object with the format, the code or the path, and
+            options
+        """
+        try:
+            data: Any = json.loads(body)
+            class_: type[Moire] = self.classes[data["format"]]
+            text: str | None = data.get("text")
+            path: str | None = data.get("path")
+            wrap: bool = bool(data.get("wrap", True))
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return Response.from_json(
+                HTTPStatus.BAD_REQUEST, {"error": f"Wrong request: {error!r}."}
+            )
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        async with self.semaphore:
+            try:
+                output: str = await loop.run_in_executor(
+                    self.executor,
+                    partial(convert_code, class_, text, path, wrap=wrap),
+                )
+            except ParseError as error:
+                return Response.from_json(
+                    HTTPStatus.UNPROCESSABLE_ENTITY, {"error": str(error)}
+                )
+            except (OSError, ValueError) as error:
+                return Response.from_json(
+                    HTTPStatus.BAD_REQUEST, {"error": str(error)}
+                )
+            except Exception as error:
+                # Errors of converters fail only the request.
+                logger.exception("Conversion failed.")
+                return Response.from_json(
+                    HTTPStatus.INTERNAL_SERVER_ERROR,
+                    {"error": f"{type(error).__name__}: {error}"},
+                )
+
+        result: bytes = output.encode("utf-8", "surrogatepass")
+        if text is not None:
+            self.statistics.input_size += len(
+                text.encode("utf-8", "surrogatepass")
+            )
+        self.statistics.output_size += len(result)
+        return Response(HTTPStatus.OK, result)
+
+
+async def read_request(reader: asyncio.StreamReader) -> Request | None:
+    """Read HTTP request.
+
+    :param reader: stream of the connection
+    :return: request, or `None` if the connection is closed
+    """
+    try:
+        head: bytes = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as error:
+        if error.partial.strip():
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST, "Incomplete request."
+            ) from error
+        return None
+    except asyncio.LimitOverrunError as error:
+        raise RequestError(
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Too large headers."
+        ) from error
+
+    lines: list[str] = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ")
+    except ValueError as error:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, "Wrong request line."
+        ) from error
+
+    headers: dict[str, str] = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        size: int = int(headers.get("content-length", "0"))
+    except ValueError as error:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, "Wrong content length."
+        ) from error
+    if size < 0:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Wrong content length.")
+    if size > MAX_BODY_SIZE:
+        raise RequestError(
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Too large request body."
+        )
+
+    try:
+        body: bytes = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as error:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, "Incomplete request body."
+        ) from error
+
+    return Request(method, target.partition("?")[0], headers, body)
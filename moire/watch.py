@@ -0,0 +1,92 @@
+"""Watching files for changes.
+
+Files are polled with `os.stat`, so that no platform notification mechanism
+is needed.  Conversion runs in the same process on every change, so converter
+classes, imported modules, and caches stay initialized between conversions.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+__author__: str = "Sergey Vartanov"
+__email__: str = "me@enzet.ru"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+POLL_INTERVAL: float = 0.2
+"""Time between checks of files in seconds."""
+
+State = dict[str, tuple[int, int] | None]
+"""Modification times in nanoseconds and sizes of files by paths, `None` for
+files that do not exist."""
+
+
+class Watcher:
+    """Poller of file changes."""
+
+    def __init__(self, get_paths: Callable[[], Iterable[str]]) -> None:
+        """Create watcher.
+
+        :param get_paths: function returning paths of files to watch, called
+            on every check, so that new files are found
+        """
+        self.get_paths: Callable[[], Iterable[str]] = get_paths
+        self.state: State | None = None
+
+    def get_state(self) -> State:
+        """Get current modification times and sizes of the files."""
+        state: State = {}
+        for path in self.get_paths():
+            try:
+                stat: os.stat_result = os.stat(path)  # noqa: PTH116
+            except OSError:
+                state[path] = None
+            else:
+                state[path] = stat.st_mtime_ns, stat.st_size
+        return state
+
+    def poll(self) -> bool:
+        """Check if files changed since the previous check.
+
+        The first check always reports a change.
+        """
+        state: State = self.get_state()
+        if state == self.state:
+            return False
+        self.state = state
+        return True
+
+
+def watch(
+    watcher: Watcher,
+    update: Callable[[], object],
+    *,
+    interval: float = POLL_INTERVAL,
+) -> None:
+    """Call the function on every change of the files until interrupted.
+
+    :param watcher: poller of the files
+    :param update: function to call, it is called once at the start; its
+        errors are logged
+    :param interval: time between checks in seconds
+    """
+    logger.info("Watching for changes, press Ctrl+C to stop.")
+    try:
+        while True:
+            if watcher.poll():
+                try:
+                    update()
+                except Exception:
+                    # Errors in the files being edited should not stop
+                    # watching.
+                    logger.exception("Update failed.")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
@@ -0,0 +1,172 @@
+"""Tests for batch conversion of directories."""
+
+from pathlib import Path
+
+import pytest
+
+from moire.__main__ import main
+from moire.build import BuildReport, build
+from moire.default import Default, DefaultHTML, DefaultMarkdown, DefaultTeX
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+CODE: str = "\\1 {Header}\n\n\\b {text}"
+
+
+def create_tree(path: Path) -> None:
+    """Create directory with Moire files, one of them is broken."""
+    (path / "a" / "b").mkdir(parents=True)
+    (path / "index.moi").write_text(CODE, encoding="utf-8")
+    (path / "a" / "b" / "page.moi").write_text(CODE, encoding="utf-8")
+    (path / "a" / "broken.moi").write_text("\\b {x}}", encoding="utf-8")
+    (path / "a" / "notes.txt").write_text("not Moire", encoding="utf-8")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build(tmp_path: Path, jobs: int) -> None:
+    """Test that layout is mirrored and errors do not stop the build."""
+    create_tree(tmp_path / "source")
+    report: BuildReport = build(
+        tmp_path / "source", tmp_path / "output", DefaultHTML, jobs=jobs
+    )
+
+    assert report.converted == 2  # noqa: PLR2004
+    assert [result.source.name for result in report.failed] == ["broken.moi"]
+    assert "Unmatched" in str(report.failed[0].error)
+
+    expected: str = DefaultHTML().convert(CODE)
+    for path in "index.html", "a/b/page.html":
+        assert (tmp_path / "output" / path).read_text() == expected
+    assert not (tmp_path / "output" / "a" / "broken.html").exists()
+    assert not (tmp_path / "output" / "a" / "notes.txt").exists()
+
+
+def test_build_unreadable_source(tmp_path: Path) -> None:
+    """Test that a broken link fails only its file."""
+    create_tree(tmp_path / "source")
+    (tmp_path / "source" / "dangling.moi").symlink_to(tmp_path / "missing")
+    report: BuildReport = build(
+        tmp_path / "source", tmp_path / "output", DefaultHTML, jobs=1
+    )
+
+    assert report.converted == 2  # noqa: PLR2004
+    errors: dict[str, str | None] = {
+        result.source.name: result.error for result in report.failed
+    }
+    assert sorted(errors) == ["broken.moi", "dangling.moi"]
+    assert "FileNotFoundError" in str(errors["dangling.moi"])
+
+
+def test_build_command(tmp_path: Path) -> None:
+    """Test `build` command with the format extension and exit status."""
+    create_tree(tmp_path / "source")
+    with pytest.raises(SystemExit):
+        main(
+            [
+                "build",
+                str(tmp_path / "source"),
+                str(tmp_path / "output"),
+                "-f",
+                "tex",
+                "-j",
+                "1",
+            ],
+            Default,
+        )
+
+    assert (tmp_path / "output" / "a" / "b" / "page.tex").read_text() == (
+        DefaultTeX().convert(CODE)
+    )
+
+
+def test_incremental_build(tmp_path: Path) -> None:
+    """Test that only changed files are converted again."""
+    create_tree(tmp_path / "source")
+    source: Path = tmp_path / "source"
+    output: Path = tmp_path / "output"
+    build(source, output, DefaultHTML, jobs=1)
+
+    report: BuildReport = build(source, output, DefaultHTML, jobs=1)
+    assert report.converted == 0
+    assert report.skipped == 2  # noqa: PLR2004
+    assert len(report.failed) == 1
+
+    # The same content with another modification time is not converted.
+    (source / "index.moi").write_text(CODE, encoding="utf-8")
+    (source / "a" / "b" / "page.moi").write_text("\\b {new}", encoding="utf-8")
+    (source / "a" / "broken.moi").unlink()
+    report = build(source, output, DefaultHTML, jobs=1)
+    assert report.converted == 1
+    assert report.skipped == 1
+    assert not report.failed
+    assert (output / "a" / "b" / "page.html").read_text() == (
+        DefaultHTML().convert("\\b {new}")
+    )
+
+    (source / "index.moi").unlink()
+    report = build(source, output, DefaultHTML, jobs=1)
+    assert report.removed == 1
+    assert not (output / "index.html").exists()
+
+    report = build(source, output, DefaultHTML, jobs=1, force=True)
+    assert report.converted == 1
+
+
+def test_build_formats(tmp_path: Path) -> None:
+    """Test that formats built into one directory do not affect each other."""
+    create_tree(tmp_path / "source")
+    source: Path = tmp_path / "source"
+    output: Path = tmp_path / "output"
+    (source / "a" / "broken.moi").unlink()
+    build(source, output, DefaultHTML, jobs=1)
+
+    report: BuildReport = build(source, output, DefaultMarkdown, jobs=1)
+    assert report.converted == 2  # noqa: PLR2004
+    assert report.removed == 0
+    assert (output / "index.md").exists()
+    assert (output / "index.html").exists()
+
+    report = build(source, output, DefaultHTML, jobs=1)
+    assert report.skipped == 2  # noqa: PLR2004
+
+    (source / "index.moi").unlink()
+    report = build(source, output, DefaultMarkdown, jobs=1)
+    assert report.removed == 1
+    assert not (output / "index.md").exists()
+    assert (output / "index.html").exists()
+
+
+def test_forced_build(tmp_path: Path) -> None:
+    """Test that forced builds delete outputs of removed sources."""
+    create_tree(tmp_path / "source")
+    source: Path = tmp_path / "source"
+    output: Path = tmp_path / "output"
+    build(source, output, DefaultHTML, jobs=1)
+
+    (source / "index.moi").unlink()
+    report: BuildReport = build(source, output, DefaultHTML, jobs=1, force=True)
+    assert report.converted == 1
+    assert report.removed == 1
+    assert not (output / "index.html").exists()
+
+
+def test_build_error_keeps_entry(tmp_path: Path) -> None:
+    """Test that outputs of files that fail are deleted with the sources."""
+    create_tree(tmp_path / "source")
+    source: Path = tmp_path / "source"
+    output: Path = tmp_path / "output"
+    build(source, output, DefaultHTML, jobs=1)
+
+    (source / "index.moi").write_text("\\b {x}}", encoding="utf-8")
+    report: BuildReport = build(source, output, DefaultHTML, jobs=1)
+    assert sorted(result.source.name for result in report.failed) == [
+        "broken.moi",
+        "index.moi",
+    ]
+    assert (output / "index.html").read_text() == DefaultHTML().convert(CODE)
+
+    (source / "index.moi").unlink()
+    report = build(source, output, DefaultHTML, jobs=1)
+    assert report.removed == 1
+    assert not (output / "index.html").exists()
@@ -0,0 +1,72 @@
+"""Tests for the cache of intermediate representations."""
+
+from pathlib import Path
+from typing import Any
+
+from moire.cache import CACHE_SUFFIX, IRCache, decode_ir, encode_ir
+from moire.default import DefaultHTML
+from moire.moire import Moire
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+CODE: str = "\\1 {Header}\n\ntext \\b {bold \\i {x}} {} /* comment */ \\{"
+
+
+def test_encoding() -> None:
+    """Test that decoded representation is equal to the original one."""
+    for code in (CODE, ""):
+        ir: list[Any] = Moire().get_ir(code)
+        assert decode_ir(encode_ir(ir)) == ir
+
+    # Deeply nested representation is compared by its codes, since list
+    # comparison is recursive.
+    depth: int = 10_000
+    codes: list[Any] = encode_ir(Moire().get_ir("\\b {" * depth + "}" * depth))
+    assert encode_ir(decode_ir(codes)) == codes
+
+
+def test_cache_hit(tmp_path: Path) -> None:
+    """Test that the second conversion reads the representation from cache."""
+    converter: DefaultHTML = DefaultHTML(ir_cache=IRCache(tmp_path))
+    expected: str = converter.convert(CODE)
+    assert len(list(tmp_path.glob(f"*{CACHE_SUFFIX}"))) == 1
+
+    cached: DefaultHTML = DefaultHTML(ir_cache=IRCache(tmp_path))
+    assert cached.ir_cache is not None
+    key: str = cached.ir_cache.get_key(CODE)
+    assert cached.ir_cache.get(CODE) is not None
+    assert cached.convert(CODE) == expected
+    assert (tmp_path / (key + CACHE_SUFFIX)).exists()
+
+
+def test_broken_entry(tmp_path: Path) -> None:
+    """Test that broken cache entry is ignored and removed."""
+    cache: IRCache = IRCache(tmp_path)
+    path: Path = tmp_path / (cache.get_key(CODE) + CACHE_SUFFIX)
+    path.write_bytes(b"broken")
+    assert cache.get(CODE) is None
+    assert not path.exists()
+
+
+def test_eviction(tmp_path: Path) -> None:
+    """Test that the least recently used entries are removed."""
+    cache: IRCache = IRCache(tmp_path, max_size=1)
+    converter: Moire = Moire(ir_cache=cache)
+    converter.get_ir("first")
+    converter.get_ir("second")
+    assert cache.get("first") is None
+    assert cache.size <= 1
+
+
+def test_outline_cache(tmp_path: Path) -> None:
+    """Test that header identifiers are read from cache."""
+    code: str = "\\1 {Header} {header} \\label {label}"
+    cache: IRCache = IRCache(tmp_path)
+    ids: list[tuple[str, int]] = Moire(ir_cache=cache).get_ids(code)
+    assert ids == [("header", 1), ("label", 0)]
+    assert cache.get_outline(code) == ids
+    assert cache.get(code) is None
+
+    cache.put_outline(code, [("cached", 0)])
+    assert Moire(ir_cache=cache).get_ids(code) == [("cached", 0)]
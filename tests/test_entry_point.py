@@ -0,0 +1,65 @@
+"""Tests for the command line entry point."""
+
+from pathlib import Path
+
+import pytest
+
+from moire.__main__ import FORMATS, get_converter_class, main
+from moire.default import Default, DefaultHTML
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+
+def test_formats() -> None:
+    """Test that lazily loaded formats are the default converters."""
+    assert set(FORMATS) == {
+        class_.id_
+        for class_ in Default.__subclasses__()
+        if class_.__module__ == Default.__module__
+    }
+    for format_ in FORMATS:
+        assert get_converter_class(None, format_) is get_converter_class(
+            Default, format_
+        )
+    assert get_converter_class(None, "unknown") is None
+
+
+def test_convert(tmp_path: Path) -> None:
+    """Test conversion of a file with the format loaded by identifier."""
+    (tmp_path / "a.moi").write_text("\\b {text}", encoding="utf-8")
+    main(
+        [
+            "-i",
+            str(tmp_path / "a.moi"),
+            "-f",
+            "html",
+            "-o",
+            str(tmp_path / "a.html"),
+        ]
+    )
+    assert (tmp_path / "a.html").read_text(encoding="utf-8") == (
+        DefaultHTML().convert("\\b {text}")
+    )
+
+
+def test_convert_error(tmp_path: Path) -> None:
+    """Test that the previous output is kept if conversion fails."""
+    (tmp_path / "a.moi").write_text("\\b {ok} \\foo {x}", encoding="utf-8")
+    (tmp_path / "a.html").write_text("previous", encoding="utf-8")
+    with pytest.raises(ValueError, match="Unknown tag"):
+        main(
+            [
+                "-i",
+                str(tmp_path / "a.moi"),
+                "-f",
+                "html",
+                "-o",
+                str(tmp_path / "a.html"),
+            ]
+        )
+    assert (tmp_path / "a.html").read_text(encoding="utf-8") == "previous"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "a.html",
+        "a.moi",
+    ]
@@ -1,8 +1,42 @@
 """Tests for Moire main module."""
 
-from typing import Any
-
-from moire.moire import Moire, Tag, serialize
+import random
+import sys
+from io import StringIO
+from typing import Any, ClassVar
+
+import pytest
+
+from moire.default import (
+    DefaultHTML,
+    DefaultMarkdown,
+    DefaultTeX,
+    DefaultText,
+    DefaultWiki,
+    EmptyLineWriter,
+    collapse_empty_lines,
+)
+from moire.moire import (
+    LexemeType,
+    Moire,
+    Output,
+    ParseError,
+    ParseState,
+    Tag,
+    TokenStream,
+    Tree,
+    build_content_tree,
+    compile_escape,
+    convert_formats,
+    get_outline,
+    lexer,
+    serialize,
+    span_lexer,
+    split_paragraphs,
+    strip_comments,
+    tokenize,
+    trim_inside,
+)
 
 converter: Moire = Moire()
 
@@ -105,3 +139,607 @@ def test_tag_in_table_serialization() -> None:
         [Tag("table", [[["a", Tag("nbs", [""]), "a"], ["b"]], [["c"], ["d"]]])],
         "\\table {{a\\nbs {}a} {b}} {{c} {d}}",
     )
+
+
+def test_span_lexer_matches_reference() -> None:
+    """Test that span lexer produces the same lexemes as reference lexer."""
+    generator: random.Random = random.Random(42)  # noqa: S311
+    alphabet: str = "\\{} a1\n.ё"
+    for _ in range(5000):
+        text: str = "".join(
+            generator.choice(alphabet) for _ in range(generator.randint(0, 16))
+        )
+        assert span_lexer(text) == lexer(text), text
+
+
+def test_span_lexer_edge_cases() -> None:
+    """Test span lexer on unusual tag and text combinations."""
+    for text in (
+        "\\a\\{b {x}",
+        "\\ab}cd {x}",
+        "\\b text {x}",
+        "text\\",
+        "\\b text",
+        "a{b}c\\d e",
+    ):
+        assert span_lexer(text) == lexer(text), text
+
+
+def test_lexer_engine_selector() -> None:
+    """Test that both lexer engines give the same representation."""
+    code: str = "\\table{{a}{\\b {b}}}{{c}{d\\}}}"
+    assert converter.get_ir(code, engine="reference") == converter.get_ir(
+        code, engine="span"
+    )
+    with pytest.raises(ValueError, match="Unknown lexer engine"):
+        converter.get_ir(code, engine="unknown")
+
+
+def test_comments_removal() -> None:
+    """Test comment removal."""
+    check_parsing("a/* comment */b", ["ab"])
+    check_parsing("a/* /* */b*/c", ["abc"])
+    check_parsing("a/*/b*/c", ["ac"])
+
+
+def test_comments_source_map() -> None:
+    """Test mapping of offsets in text without comments to the source."""
+    source: str = "ab/* comment */cd/**/e"
+    text, source_map = strip_comments(source)
+    assert text == "abcde"
+    for index, char in enumerate(text):
+        assert source[source_map.to_source(index)] == char
+
+
+def test_error_position_after_comment() -> None:
+    """Test that error position refers to the source with comments."""
+    with pytest.raises(ParseError, match=r"Unmatched `}` at 13\."):
+        converter.get_ir("/* comment */}")
+
+
+def test_unmatched_brace_errors() -> None:
+    """Test collecting of structural errors."""
+    errors: list[ParseError] = []
+    assert converter.get_ir("a}{b", errors=errors) == ["a", ["b"]]
+    assert [(x.message, x.position) for x in errors] == [
+        ("Unmatched `}`", 1),
+        ("Unclosed `{`", 2),
+    ]
+
+
+def test_deep_nesting() -> None:
+    """Test nesting deeper than the recursion limit."""
+    depth: int = sys.getrecursionlimit() * 2
+    element: Any = converter.get_ir("{" * depth + "a" + "}" * depth)
+    for _ in range(depth):
+        element = element[0]
+    assert element == ["a"]
+
+
+def test_trim_inside() -> None:
+    """Test collapsing of space sequences."""
+    assert trim_inside("a  b\n\n\tc\r") == "a b c "
+    assert trim_inside("a b\nc") == "a b c"
+    text: str = "no sequences to collapse"
+    assert trim_inside(text) is text
+
+
+def test_token_stream() -> None:
+    """Test array-backed lexeme storage."""
+    tokens: TokenStream = tokenize("a \\b {c}\\{")
+    assert list(tokens.types) == [
+        LexemeType.TEXT,
+        LexemeType.TAG,
+        LexemeType.PARAMETER_BEGIN,
+        LexemeType.TEXT,
+        LexemeType.PARAMETER_END,
+        LexemeType.SYMBOL,
+    ]
+    assert [tokens.content(index) for index in range(len(tokens))] == [
+        "a ",
+        "b",
+        None,
+        "c",
+        None,
+        "{",
+    ]
+
+
+def test_chunked_input() -> None:
+    """Test parsing of text that comes in chunks."""
+    code: str = "text \\b {bold}/* comment */ \\{\\ref {link} {text}"
+    expected: list[Any] = converter.get_ir(code)
+    for size in range(1, len(code) + 1):
+        chunks: list[str] = [
+            code[index : index + size] for index in range(0, len(code), size)
+        ]
+        assert converter.get_ir(iter(chunks)) == expected, size
+
+
+def test_file_input() -> None:
+    """Test parsing of file-like object."""
+    code: str = "\\table{{a}{b}}{{c}{d}}/* comment */"
+    assert converter.get_ir(StringIO(code)) == converter.get_ir(code)
+
+
+def test_incremental_update() -> None:
+    """Test that updated state is the same as the state of the edited text."""
+    text: str = "\\1 {Header}\n\ntext \\b {bold} /* \\i {x} */ \\ref {a} {b}"
+    edits: list[tuple[int, int, str]] = [
+        (14, 4, "plain"),
+        (0, 0, "\\2 {New} "),
+        (20, 0, "/*"),
+        (21, 0, "{"),
+        (5, 0, "\\{"),
+    ]
+    for offset, removed, inserted in edits:
+        state: ParseState = converter.get_state(text)
+        new_text: str = text[:offset] + inserted + text[offset + removed :]
+        updated: ParseState = converter.update_state(
+            state, offset, removed, inserted
+        )
+        expected: ParseState = converter.get_state(new_text)
+        assert updated.ir == expected.ir
+        assert updated.checkpoints == expected.checkpoints
+
+
+def test_incremental_update_reuses_tags() -> None:
+    """Test that tags outside of the edited region are reused."""
+    state: ParseState = converter.get_state("\\b {a} \\i {b} text \\c {c}")
+    first: Any = state.ir[0]
+    last: Any = state.ir[-1]
+    updated: ParseState = converter.update_state(state, 14, 4, "word")
+    assert updated.ir[0] is first
+    assert updated.ir[-1] is last
+    assert updated.ir == converter.get_ir("\\b {a} \\i {b} word \\c {c}")
+
+
+def test_incremental_update_scaling() -> None:
+    """Test that checkpoints far from the edit are not rebuilt."""
+    text: str = "\\b {bold} text\n\n" * 10_000
+    state: ParseState = converter.get_state(text)
+    blocks: list[Any] = list(state.checkpoints.blocks)
+    shifts: list[tuple[int, int]] = list(state.checkpoints.shifts)
+
+    offset: int = len(text) // 2
+    converter.update_state(state, offset, 0, "\\i {new} ")
+
+    # Only the blocks around the edit are new, the blocks after it are only
+    # shifted as a whole.
+    new_blocks: list[Any] = [
+        block
+        for block in state.checkpoints.blocks
+        if not any(block is old_block for old_block in blocks)
+    ]
+    assert len(new_blocks) <= 3  # noqa: PLR2004
+    assert state.checkpoints.shifts[0] == shifts[0]
+    assert state.checkpoints.shifts[-1] == (
+        shifts[-1][0] + len("\\i {new} "),
+        shifts[-1][1] + 2,
+    )
+
+    expected: ParseState = converter.get_state(
+        text[:offset] + "\\i {new} " + text[offset:]
+    )
+    assert state.ir == expected.ir
+    assert state.checkpoints == expected.checkpoints
+
+
+def test_tag_immutable() -> None:
+    """Test that tag fields cannot be changed."""
+    tag: Tag = Tag("b", [["text"]])
+    assert tag.parameters == (["text"],)
+    with pytest.raises(AttributeError):
+        tag.id = "i"  # type: ignore[misc]
+
+
+def test_tag_keywords() -> None:
+    """Test that tags are created with the field names as keywords."""
+    tag: Tag = Tag(id="1", parameters=[["text"]])
+    assert tag == Tag("1", [["text"]])
+    assert tag.level == 1
+
+
+def test_tag_identifier_interned() -> None:
+    """Test that equal tag names share one string."""
+    first, _, second = converter.get_ir("\\code {a} \\code {b}")
+    assert first.id is second.id
+
+
+def test_tag_hash() -> None:
+    """Test that equal tags have equal hashes, even if deeply nested."""
+    depth: int = 10_000
+    code: str = "\\b {" * depth + "}" * depth
+    first: Tag = converter.get_ir(code)[0]
+    second: Tag = converter.get_ir(code)[0]
+    assert first is not second
+    assert hash(first) == hash(second)
+    assert {Tag("a", [["x"]]), Tag("a", [["x"]]), Tag("a", [["y"]])} == {
+        Tag("a", [["x"]]),
+        Tag("a", [["y"]]),
+    }
+
+
+class Base(Moire):
+    """Converter with handlers of different kinds."""
+
+    def b(self, arg: Any) -> str:
+        """Make text bold."""
+        return f"<b>{self.parse(arg[0])}</b>"
+
+    def del__(self, arg: Any) -> str:
+        """Mark text as deleted."""
+        return f"<del>{self.parse(arg[0])}</del>"
+
+    @staticmethod
+    def br(_: Any) -> str:
+        """Add line break."""
+        return "<br>"
+
+
+class Derived(Base):
+    """Converter that overrides a handler of the base class."""
+
+    def b(self, arg: Any) -> str:
+        """Make text strong."""
+        return f"<strong>{self.parse(arg[0])}</strong>"
+
+    def del_(self, arg: Any) -> str:
+        """Not a handler of `del`."""
+        return self.parse(arg[0])
+
+
+def test_handlers() -> None:
+    """Test selection of tag handlers."""
+    code: str = "\\b {a} \\br {} \\del {b}"
+    assert Base().convert(code, wrap=False) == "<b>a</b> <br> <del>b</del>"
+    assert (
+        Derived().convert(code, wrap=False)
+        == "<strong>a</strong> <br> <del>b</del>"
+    )
+
+    definition: str = "\\define {b} {\\br {}}"
+    assert (
+        Derived().convert(definition + code, wrap=False)
+        == "<br> <br> <del>b</del>"
+    )
+    assert Base.get_handlers() is not Derived.get_handlers()
+
+
+class Prepared(Moire):
+    """Converter that collects headers before rendering."""
+
+    def pre_header(self, arg: Any, level: int) -> str:
+        """Collect header."""
+        self.status.setdefault("headers", []).append((level, arg[0]))
+        return ""
+
+    def header(self, arg: Any, level: int) -> str:
+        """Add header with its number, 0 if it was not collected."""
+        headers: list[tuple[int, Any]] = self.status["headers"]
+        number: int = (
+            headers.index((level, arg[0])) + 1
+            if (level, arg[0]) in headers
+            else 0
+        )
+        return f"{number}. {self.parse(arg[0])}"
+
+    def b(self, arg: Any) -> str:
+        """Make text bold."""
+        return self.parse(arg[0])
+
+
+def test_preliminary_pass() -> None:
+    """Test that `pre_` handlers are called for tags outside other tags."""
+    converter_: Prepared = Prepared()
+    code: str = "\\2 {a} \\b {\\1 {c}} \\1 {b}"
+    assert converter_.convert(code, wrap=False) == "1. a 0. c 2. b"
+    assert converter_.status["headers"] == [(2, ["a"]), (1, ["b"])]
+
+    # Tags in brace groups are not inside other tags.
+    converter_ = Prepared()
+    code = "{\\2 {nested}} {{\\3 {deep}}} \\1 {top}"
+    assert converter_.convert(code, wrap=False) == "1. nested2. deep 3. top"
+    assert converter_.status["headers"] == [
+        (2, ["nested"]),
+        (3, ["deep"]),
+        (1, ["top"]),
+    ]
+    assert not Moire.get_handlers("pre_")
+
+
+STREAMED_CODE: str = """\\title {Title}
+
+\\1 {Header} \\2 {Subheader}
+
+\\s {Paragraph} with \\e {emphasis} \\c {code}
+
+\\list {\\s {first}} {\\e {second} \\c {code}}
+
+\\table {{a}{b}} {{c}{d}}
+"""
+
+
+@pytest.mark.parametrize(
+    "class_",
+    [DefaultHTML, DefaultTeX, DefaultText, DefaultMarkdown, DefaultWiki],
+)
+def test_streaming(class_: type[Moire]) -> None:
+    """Test that streamed output is the same as the returned one."""
+    expected: str = class_().convert(STREAMED_CODE)
+    output: StringIO = StringIO()
+    assert class_().convert(STREAMED_CODE, output=output) == ""
+    assert output.getvalue() == expected
+
+
+class Streamed(Base):
+    """Converter with a streaming handler."""
+
+    def stream_b(self, arg: Any, output: StringIO) -> None:
+        """Write bold text."""
+        output.write("<b>")
+        self.stream(arg[0], output)
+        output.write("</b>")
+
+
+def test_streaming_handlers() -> None:
+    """Test that streaming handlers are mixed with usual ones."""
+    code: str = "\\b {a \\del {b \\b {c}}} \\br {}"
+    output: StringIO = StringIO()
+    Streamed().convert(code, wrap=False, output=output)
+    assert output.getvalue() == Base().convert(code, wrap=False)
+
+
+def test_empty_line_writer() -> None:
+    """Test that newlines split between fragments are collapsed."""
+    fragments: list[str] = ["a\n", "\n", "", "\n\nb\n\n", "\nc", "\n\n\n"]
+    output: StringIO = StringIO()
+    writer: EmptyLineWriter = EmptyLineWriter(output)
+    for fragment in fragments:
+        writer.write(fragment)
+    writer.flush()
+    assert output.getvalue() == collapse_empty_lines("".join(fragments))
+    assert output.getvalue() == "a\n\nb\n\nc\n\n"
+
+
+def test_output() -> None:
+    """Test output builder."""
+    output: Output = Output("<ul>")
+    for item in "ab":
+        output.add("<li>", item, "</li>")
+    converter.stream(["c"], output)
+    output.write("</ul>")
+    assert output.build() == "<ul><li>a</li><li>b</li>c</ul>"
+
+
+class Counted(Base):
+    """Converter that counts rendered bold tags."""
+
+    count: int = 0
+
+    def b(self, arg: Any) -> str:
+        """Make text bold and count it."""
+        self.count += 1
+        return super().b(arg)
+
+
+def test_macro() -> None:
+    """Test that macro arguments are rendered once and only if referenced."""
+    counted: Counted = Counted()
+    code: str = (
+        "\\define {m} {\\arg {1} \\del {\\arg {1}}} \\m {\\b {a}} {\\b {b}}"
+    )
+    assert counted.convert(code, wrap=False) == " <b>a</b> <del><b>a</b></del>"
+    assert counted.count == 1
+
+    # Argument refers to the preceding arguments of the same tag.
+    code = "\\define {m} {\\arg {2}} \\m {first} {\\b {\\arg {1}}}"
+    assert Base().convert(code, wrap=False) == " <b>first</b>"
+
+
+@pytest.mark.parametrize(
+    "symbols",
+    [
+        {},
+        {"a": "b", "b": "c"},
+        {"b": "c", "a": "b"},
+        {"&": "&amp;", "<": "&lt;", ">": "&gt;"},
+        {"<": "&lt;", "&": "&amp;"},
+        {"ab": "x", "x": "yy", "_": ""},
+    ],
+)
+def test_escape(symbols: dict[str, str]) -> None:
+    """Test that symbols are replaced as if one by one in order."""
+    for text in ["", "plain", "a < b & c > d", "abxab_b", "&lt;"]:
+        expected: str = text
+        for key, value in symbols.items():
+            expected = expected.replace(key, value)
+        assert compile_escape(symbols)(text) == expected
+
+
+class QuotedHTML(DefaultHTML):
+    """HTML converter that also escapes quotes."""
+
+    escape_symbols: ClassVar[dict[str, str]] = {
+        **DefaultHTML.escape_symbols,
+        '"': "&quot;",
+    }
+
+
+def test_html_escape() -> None:
+    """Test that ampersands are escaped with any symbols of subclasses."""
+    assert DefaultHTML().escape('a & "b" <c>') == 'a &amp; "b" &lt;c&gt;'
+    assert QuotedHTML().escape('a & "b"') == "a &amp; &quot;b&quot;"
+
+
+def test_escape_symbols_change() -> None:
+    """Test that changes of escape symbols in place are applied."""
+
+    class Escaped(Base):
+        escape_symbols: ClassVar[dict[str, str]] = {"a": "b"}
+
+    assert Escaped().escape("ab") == "bb"
+    Escaped.escape_symbols["b"] = "c"
+    assert Escaped().escape("ab") == "cc"
+
+
+def test_render_cache() -> None:
+    """Test that equal tags are formatted once if render cache is enabled."""
+    code: str = "\\b {a} \\del {\\b {a}} \\b {b} \\b {a}"
+    expected: str = Counted().convert(code, wrap=False)
+
+    # Bold tags with different content.
+    counted: Counted = Counted(render_cache_size=100)
+    assert counted.convert(code, wrap=False) == expected
+    assert counted.count == 2  # noqa: PLR2004
+
+    # The first tag is evicted by the second one.
+    counted = Counted(render_cache_size=1)
+    assert counted.convert(code, wrap=False) == expected
+    assert counted.count == 3  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        STREAMED_CODE,
+        (
+            "\\list {\\c {a}} {\\list {\\c {a}} {\\list {\\c {a}}}} "
+            "\\list {\\c {a}}"
+        ),
+        "\\define {m} {\\c {\\arg {1}}} \\m {a} \\m {b} \\c {a}",
+        "\\e {\\c {x}} \\define {c} {MACRO} \\e {\\c {x}}",
+    ],
+)
+def test_render_cache_output(code: str) -> None:
+    """Test that render cache does not change the output."""
+    for class_ in DefaultHTML, DefaultMarkdown, DefaultTeX:
+        cached: Moire = class_()
+        cached.render_cache_size = 100
+        assert cached.convert(code) == class_().convert(code)
+
+
+def test_convert_formats() -> None:
+    """Test conversion into several formats from one parse."""
+    classes: list[type[Moire]] = [DefaultHTML, DefaultMarkdown, DefaultTeX]
+    converters: list[Moire] = [class_() for class_ in classes]
+    results: list[str] = convert_formats(STREAMED_CODE, converters)
+    assert results == [class_().convert(STREAMED_CODE) for class_ in classes]
+    assert converters[0].status["tree"] is converters[-1].status["tree"]
+
+    output: StringIO = StringIO()
+    assert convert_formats(
+        STREAMED_CODE, [DefaultHTML(), DefaultTeX()], outputs=[None, output]
+    ) == [results[0], ""]
+    assert output.getvalue() == results[-1]
+
+
+@pytest.mark.parametrize(
+    ("elements", "expected"),
+    [
+        (["a"], [["a"]]),
+        (["a\n\nb"], [["a"], ["b"]]),
+        (["a\n\n\n\nb"], [["a"], ["b"]]),
+        (["\n\na"], [[""], ["a"]]),
+        (["a\n\n"], [["a"], [""]]),
+        ([Tag("b", [["x"]]), "\n\na"], [[Tag("b", [["x"]]), ""], ["a"]]),
+        (["a\n\n \n\nb"], [["a"], [" "], ["b"]]),
+    ],
+)
+def test_split_paragraphs(elements: list[Any], expected: list[Any]) -> None:
+    """Test splitting of elements by paragraph delimiters."""
+    assert split_paragraphs(elements) == expected
+
+
+def test_paragraphs() -> None:
+    """Test that paragraph ends are stripped and text is wrapped."""
+    bold: Tag = Tag("b", [["x"]])
+    assert Moire.get_paragraphs([""]) == []
+    assert Moire.get_paragraphs([" a \n\n\n", bold, "\n\n \n\n b"]) == [
+        Tag("text", [["a"]]),
+        [bold],
+        Tag("text", [["b"]]),
+    ]
+    assert Moire.get_paragraphs([" \n", bold, " "]) == [[bold]]
+
+
+def test_header_level() -> None:
+    """Test that header levels are computed on tag creation."""
+    assert [Tag(id_).level for id_ in ["1", "6", "12", "7", "b", "0"]] == [
+        1,
+        6,
+        12,
+        0,
+        0,
+        0,
+    ]
+    assert Tag("3").is_header()
+    assert not Tag("label").is_header()
+
+
+def test_content_tree() -> None:
+    """Test content table and index of headers and labels."""
+    ir: list[Any] = Moire().get_ir(
+        "\\1 {A} {a}\n\\label {l}\n\\3 {B} {b}\n\\2 {C}\n\\1 {D} {a}"
+    )
+    root: Tree = build_content_tree(ir)
+    assert [child.element.parameters[0] for child in root.children] == [
+        ["A"],
+        ["D"],
+    ]
+    first: Tree = root.children[0]
+    assert [child.element.id for child in first.children] == ["3", "2"]
+    assert first.children[1].number == 1
+
+    assert root.index is not None
+    assert [(key, entry.level) for key, entry in root.index.items()] == [
+        ("a", 1),
+        ("l", 0),
+        ("b", 3),
+    ]
+    assert root.index["a"].node is first
+    assert root.index["l"].node is first
+    assert root.index["b"].node.parent is first
+    assert ir[root.index["b"].position] is root.index["b"].node.element
+
+
+def test_header_index() -> None:
+    """Test that converter exposes the index of the converted document."""
+    html: DefaultHTML = DefaultHTML()
+    html.convert("\\1 {Header} {header}\n\ntext")
+    assert html.header_index["header"].level == 1
+
+
+OUTLINE_CODE: list[str] = [
+    "",
+    "text",
+    "\\1 {Header} {header}\n\ntext \\label {label} \\2 {No identifier}",
+    "\\1 {A} skipped {a} \\b {\\3 {B} {b}} \\label {\\{x} /* \\2 {C} {c} */",
+    "\\1 {A} \\{ {a} \\2 {B}\\label {l} x\\\\label {m}",
+    "\\b {x \\label} {leaked}",
+    "\\la\\{bel {interrupted}",
+    "\\label {\\b {tag}}",
+    "\\label {a} \\ä {b}",
+]
+
+
+@pytest.mark.parametrize("code", OUTLINE_CODE)
+def test_outline(code: str) -> None:
+    """Test that identifiers are the same as in the representation."""
+    expected: list[tuple[str, int]] = []
+    for element in Moire().get_ir(code):
+        if isinstance(element, Tag):
+            if element.level and len(element.parameters) > 1:
+                expected.append((element.parameters[1][0], element.level))
+            if element.id == "label":
+                expected.append((element.parameters[0][0], 0))
+
+    assert Moire().get_ids(code) == expected
+    assert get_outline(code) in (expected, None)
+
+
+def test_outline_unmatched_brace() -> None:
+    """Test that unmatched brace is reported at its source position."""
+    with pytest.raises(ParseError) as error:
+        get_outline("/* { */ \\1 {A} {a}}")
+    assert error.value.position == len("/* { */ \\1 {A} {a}")
@@ -0,0 +1,115 @@
+"""Tests for the conversion server."""
+
+import asyncio
+import json
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+
+from moire.default import DefaultHTML, DefaultMarkdown
+from moire.moire import Moire
+from moire.server import Server
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+CLASSES: dict[str, type[Moire]] = {
+    DefaultHTML.id_: DefaultHTML,
+    DefaultMarkdown.id_: DefaultMarkdown,
+}
+
+
+async def send(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    path: str,
+    data: Any = None,
+) -> tuple[int, bytes]:
+    """Send HTTP request over the open connection.
+
+    :return: status code and body of the response
+    """
+    body: bytes = b"" if data is None else json.dumps(data).encode("utf-8")
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+        + body
+    )
+    await writer.drain()
+
+    head: list[str] = (
+        (await reader.readuntil(b"\r\n\r\n")).decode("ascii").split("\r\n")
+    )
+    headers: dict[str, str] = dict(
+        line.lower().split(": ", 1) for line in head[1:] if line
+    )
+    return int(head[0].split(" ")[1]), await reader.readexactly(
+        int(headers["content-length"])
+    )
+
+
+async def check_server(path: Path) -> None:
+    """Send conversion and statistics requests over one connection.
+
+    :param path: Moire file with italic `text`
+    """
+    server: Server = Server(CLASSES, jobs=1)
+    try:
+        tcp_server: asyncio.Server = await server.start(port=0)
+        port: int = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        status, body = await send(
+            reader,
+            writer,
+            "POST",
+            "/convert",
+            {"format": "html", "text": "\\b {text}", "wrap": False},
+        )
+        assert (status, body) == (HTTPStatus.OK, b"<b>text</b>")
+
+        status, body = await send(
+            reader,
+            writer,
+            "POST",
+            "/convert",
+            {"format": "markdown", "path": str(path), "wrap": False},
+        )
+        assert (status, body) == (HTTPStatus.OK, b"*text*")
+
+        status, body = await send(
+            reader, writer, "POST", "/convert", {"format": "html", "text": "}"}
+        )
+        assert status == HTTPStatus.UNPROCESSABLE_ENTITY
+        assert b"Unmatched" in body
+
+        status, _ = await send(
+            reader, writer, "POST", "/convert", {"format": "unknown"}
+        )
+        assert status == HTTPStatus.BAD_REQUEST
+        status, _ = await send(reader, writer, "GET", "/convert")
+        assert status == HTTPStatus.METHOD_NOT_ALLOWED
+        status, _ = await send(reader, writer, "GET", "/unknown")
+        assert status == HTTPStatus.NOT_FOUND
+
+        status, body = await send(reader, writer, "GET", "/stats")
+        statistics: dict[str, Any] = json.loads(body)
+        assert status == HTTPStatus.OK
+        assert statistics["requests"] == 4  # noqa: PLR2004
+        assert statistics["failed"] == 2  # noqa: PLR2004
+        assert statistics["active"] == 0
+
+        writer.close()
+        await writer.wait_closed()
+        tcp_server.close()
+        await tcp_server.wait_closed()
+    finally:
+        server.close()
+
+
+def test_server(tmp_path: Path) -> None:
+    """Test conversion requests, errors, and statistics."""
+    path: Path = tmp_path / "a.moi"
+    path.write_text("\\i {text}", encoding="utf-8")
+    asyncio.run(check_server(path))
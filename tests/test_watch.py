@@ -0,0 +1,125 @@
+"""Tests for watching files for changes."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from moire.__main__ import main
+from moire.default import DefaultHTML
+from moire.watch import Watcher, watch
+
+__author__ = "Sergey Vartanov"
+__email__ = "me@enzet.ru"
+
+
+def test_poll(tmp_path: Path) -> None:
+    """Test that changes, new files, and removed files are detected."""
+    path: Path = tmp_path / "a.moi"
+    path.write_text("text", encoding="utf-8")
+    paths: list[str] = [str(path)]
+    watcher: Watcher = Watcher(lambda: paths)
+
+    assert watcher.poll()
+    assert not watcher.poll()
+
+    path.write_text("other text", encoding="utf-8")
+    assert watcher.poll()
+    assert not watcher.poll()
+
+    # The same size, another modification time.
+    stat: os.stat_result = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert watcher.poll()
+
+    paths.append(str(tmp_path / "b.moi"))
+    assert watcher.poll()
+    assert not watcher.poll()
+
+    path.unlink()
+    assert watcher.poll()
+    assert not watcher.poll()
+
+
+def test_watch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the function is called on changes until interruption."""
+    path: Path = tmp_path / "a.moi"
+    path.write_text("text", encoding="utf-8")
+    calls: list[str] = []
+    sleeps: list[float] = []
+
+    def sleep(interval: float) -> None:
+        """Change the file on the second check, stop on the fourth."""
+        sleeps.append(interval)
+        if len(sleeps) == 2:  # noqa: PLR2004
+            path.write_text("new text", encoding="utf-8")
+        if len(sleeps) == 4:  # noqa: PLR2004
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr("moire.watch.time.sleep", sleep)
+    watch(
+        Watcher(lambda: [str(path)]),
+        lambda: calls.append(path.read_text(encoding="utf-8")),
+        interval=0.5,
+    )
+
+    assert calls == ["text", "new text"]
+    assert sleeps == [0.5] * 4
+
+
+def test_watch_error(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """Test that conversion errors do not stop watching."""
+    path: Path = tmp_path / "a.moi"
+    path.write_text("\\b {ok} \\foo {x}", encoding="utf-8")
+    outputs: list[str] = []
+    checks: list[None] = []
+
+    def sleep(_: float) -> None:
+        """Fix the unknown tag on the first check, stop on the third."""
+        checks.append(None)
+        if len(checks) == 1:
+            path.write_text("\\b {ok}", encoding="utf-8")
+        if len(checks) == 3:  # noqa: PLR2004
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr("moire.watch.time.sleep", sleep)
+    watch(
+        Watcher(lambda: [str(path)]),
+        lambda: outputs.append(
+            DefaultHTML().convert(path.read_text(encoding="utf-8"), wrap=False)
+        ),
+    )
+
+    assert outputs == ["<b>ok</b>"]
+    assert "Unknown tag `foo`" in caplog.text
+
+
+def test_watch_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """Test that definitions are not kept between conversions."""
+    path: Path = tmp_path / "a.moi"
+    path.write_text("\\define {zz} {MACRO} \\zz {}", encoding="utf-8")
+    output: Path = tmp_path / "a.html"
+    outputs: list[str] = []
+
+    def sleep(_: float) -> None:
+        """Remove the definition on the first check, stop on the second."""
+        outputs.append(output.read_text(encoding="utf-8"))
+        if len(outputs) == 1:
+            path.write_text("\\zz {}", encoding="utf-8")
+        else:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr("moire.watch.time.sleep", sleep)
+    main(["-i", str(path), "-f", "html", "-o", str(output), "--watch"])
+
+    assert "MACRO" in outputs[0]
+    assert outputs[1] == outputs[0]
+    assert "Unknown tag `zz`" in caplog.text